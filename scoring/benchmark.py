@@ -0,0 +1,211 @@
+import argparse, csv, itertools, json, os, random, statistics, sys, tempfile, time
+# Import local score file
+import score
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Stop IDs are two uppercase letters, which allows up to 676 stops per route
+STOP_IDS = [a+b for a,b in itertools.product('ABCDEFGHIJKLMNOPQRSTUVWXYZ',repeat=2)]
+SCENARIOS = ('identical','reversed','permuted','invalid')
+FIELDS = ['scenario','routes','min_stops','max_stops','seed','workers','repeat',
+    'best_seconds','median_seconds','routes_per_second','submission_score']
+
+def generate_inputs(directory,scenario,routes=20,min_stops=10,max_stops=400,seed=0):
+    '''
+    Writes a synthetic set of scoring inputs with the layout of the
+    competition data.
+
+    Stops are placed uniformly in a square around the station, travel times
+    are noisy and slightly asymmetric Euclidean distances, and the actual
+    sequence of each route is a nearest neighbor tour from the station.
+
+    Parameters
+    ----------
+    directory : str
+        Directory where new_actual_sequences.json, proposed_sequences.json,
+        new_travel_times.json and new_invalid_sequence_scores.json are
+        written. It is created if needed.
+    scenario : str
+        How the proposed sequences relate to the actual ones, one of
+        SCENARIOS: 'identical', 'reversed' (the station is kept first),
+        'permuted' (random order after the station) or 'invalid' (a stop is
+        dropped, so every route gets its invalid score).
+    routes : int, optional
+        Number of routes. The default is 20.
+    min_stops : int, optional
+        Minimum number of stops of a route, station included. The default is
+        10.
+    max_stops : int, optional
+        Maximum number of stops of a route, station included. The default is
+        400.
+    seed : int, optional
+        Seed of the generator. The same seed always gives the same files. The
+        default is 0.
+
+    Returns
+    -------
+    paths : dict
+        filepaths of the written files, keyed by the matching argument names
+        of score.evaluate.
+
+    '''
+    if scenario not in SCENARIOS:
+        raise ValueError("Unknown scenario '{}', expected one of {}".format(scenario,', '.join(SCENARIOS)))
+    if not 3<=min_stops<=max_stops<=len(STOP_IDS):
+        raise ValueError('Stop counts must satisfy 3 <= min_stops <= max_stops <= {}'.format(len(STOP_IDS)))
+    rng=random.Random(seed)
+    actual_routes={}
+    submission={}
+    cost_matrices={}
+    invalid_scores={}
+    for i in range(routes):
+        route='RouteID_{:06d}'.format(i)
+        stops=rng.sample(STOP_IDS,rng.randint(min_stops,max_stops))
+        points={stop:(rng.uniform(-5,5),rng.uniform(-5,5)) for stop in stops}
+        cost_matrices[route]={
+            origin:{
+                dest:0.0 if origin==dest else round(
+                    60*((x1-x2)**2+(y1-y2)**2)**0.5*rng.uniform(0.9,1.2)+rng.uniform(10,60),1)
+                for dest,(x2,y2) in points.items()
+                }
+            for origin,(x1,y1) in points.items()
+            }
+        actual=nearest_neighbor_tour(stops[0],cost_matrices[route])
+        if scenario=='identical':
+            proposed=actual
+        elif scenario=='reversed':
+            proposed=actual[:1]+actual[:0:-1]
+        elif scenario=='permuted':
+            proposed=actual[:1]+rng.sample(actual[1:],len(actual)-1)
+        else:
+            proposed=actual[:-1]
+        actual_routes[route]={'actual':{stop:position for position,stop in enumerate(actual)}}
+        submission[route]={'proposed':{stop:position for position,stop in enumerate(proposed)}}
+        invalid_scores[route]=rng.uniform(0.8,1.2)
+    os.makedirs(directory,exist_ok=True)
+    paths={
+        'actual_routes_json':os.path.join(directory,'new_actual_sequences.json'),
+        'submission_json':os.path.join(directory,'proposed_sequences.json'),
+        'cost_matrices_json':os.path.join(directory,'new_travel_times.json'),
+        'invalid_scores_json':os.path.join(directory,'new_invalid_sequence_scores.json')
+        }
+    for name,data in [('actual_routes_json',actual_routes),('submission_json',submission),
+            ('cost_matrices_json',cost_matrices),('invalid_scores_json',invalid_scores)]:
+        with open(paths[name],'w') as out_file:
+            json.dump(data,out_file)
+    return paths
+
+def nearest_neighbor_tour(station,matrix):
+    '''
+    Orders stops by repeatedly visiting the closest unvisited stop.
+
+    Parameters
+    ----------
+    station : str
+        First stop of the tour.
+    matrix : dict
+        Cost matrix of the route.
+
+    Returns
+    -------
+    tour : list
+        Every stop of the matrix, starting with station.
+
+    '''
+    tour=[station]
+    unvisited=set(matrix)-{station}
+    while unvisited:
+        times=matrix[tour[-1]]
+        nearest=min(unvisited,key=lambda stop: (times[stop],stop))
+        tour.append(nearest)
+        unvisited.remove(nearest)
+    return tour
+
+def run_scenario(scenario,routes=20,min_stops=10,max_stops=400,seed=0,repeat=3,workers=1,directory=None):
+    '''
+    Times score.evaluate on generated inputs.
+
+    Parameters
+    ----------
+    scenario : str
+        One of SCENARIOS, see generate_inputs.
+    routes : int, optional
+        Number of routes. The default is 20.
+    min_stops : int, optional
+        Minimum number of stops of a route. The default is 10.
+    max_stops : int, optional
+        Maximum number of stops of a route. The default is 400.
+    seed : int, optional
+        Seed of the generator. The default is 0.
+    repeat : int, optional
+        Number of timed evaluations. The default is 3.
+    workers : int, optional
+        Number of processes used to score routes. The default is 1.
+    directory : str, optional
+        Directory where the inputs are written and kept. If None, they are
+        written to a temporary directory that is removed afterwards. The
+        default is None.
+
+    Returns
+    -------
+    row : dict
+        One row of the benchmark table, with the fields of FIELDS.
+
+    '''
+    with tempfile.TemporaryDirectory(prefix='rc-benchmark-') as tmp_dir:
+        paths=generate_inputs(directory or tmp_dir,scenario,routes,min_stops,max_stops,seed)
+        timings=[]
+        for _ in range(repeat):
+            start=time.perf_counter()
+            scores=score.evaluate(workers=workers,**paths)
+            timings.append(time.perf_counter()-start)
+    best=min(timings)
+    return {
+        'scenario':scenario,
+        'routes':routes,
+        'min_stops':min_stops,
+        'max_stops':max_stops,
+        'seed':seed,
+        'workers':workers,
+        'repeat':repeat,
+        'best_seconds':best,
+        'median_seconds':statistics.median(timings),
+        'routes_per_second':routes/best if best else float('inf'),
+        'submission_score':scores['submission_score']
+        }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the scoring of synthetic submissions.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+        help='proposed sequences to score (default: all)')
+    parser.add_argument('--routes', type=int, nargs='+', default=[20],
+        help='numbers of routes, one benchmark each (default: 20)')
+    parser.add_argument('--stops', type=int, nargs=2, default=[10,400], metavar=('MIN','MAX'),
+        help='range of the number of stops of a route (default: 10 400)')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the input generator (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='number of timed evaluations of each benchmark (default: 3)')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of processes used to score routes, 0 uses every CPU (default: 1)')
+    parser.add_argument('--output', metavar='PATH',
+        help='write the results table to this CSV file instead of the standard output')
+    parser.add_argument('--keep-inputs', metavar='DIR',
+        help='keep the generated inputs of each benchmark in a subdirectory of DIR')
+    args = parser.parse_args()
+    args.workers = args.workers or os.cpu_count()
+
+    out_file = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(out_file, fieldnames=FIELDS)
+        writer.writeheader()
+        for routes in args.routes:
+            for scenario in args.scenarios:
+                directory = None
+                if args.keep_inputs:
+                    directory = os.path.join(args.keep_inputs, '{}_{}'.format(scenario, routes))
+                writer.writerow(run_scenario(scenario, routes, args.stops[0], args.stops[1],
+                    args.seed, args.repeat, args.workers, directory))
+                out_file.flush()
+    finally:
+        if args.output:
+            out_file.close()
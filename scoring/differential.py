@@ -0,0 +1,343 @@
+import argparse, json, os, random, sys, tempfile
+# Import local score files
+import benchmark
+import reference
+import sampling
+import score
+import sharding
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REAL_INPUTS = {
+    'actual_routes_json':os.path.join(BASE_DIR,'data/model_score_inputs/new_actual_sequences.json'),
+    'submission_json':os.path.join(BASE_DIR,'data/model_apply_outputs/proposed_sequences.json'),
+    'cost_matrices_json':os.path.join(BASE_DIR,'data/model_apply_inputs/new_travel_times.json'),
+    'invalid_scores_json':os.path.join(BASE_DIR,'data/model_score_inputs/new_invalid_sequence_scores.json')
+    }
+# Scoring modes of the fast engine compared with the reference engine (see fast_scores)
+MODES = ('default','cache','shards','sample','gap_sweep','incremental')
+GAP_PENALTIES = [0.5,10,1000]
+SAMPLE = 0.5
+# Stations of the routes of the sample mode, so that its strata have different sizes
+STATION_CODES = ('DLA7','DLA7','DBO1')
+SHARDS = 3
+
+def compare(paths,tolerance=1e-9,modes=('default',),**options):
+    '''
+    Scores the same inputs with the reference engine and with the fast engine
+    in each scoring mode, and lists their discrepancies.
+
+    Parameters
+    ----------
+    paths : dict
+        filepaths of the inputs, keyed by the argument names of evaluate.
+    tolerance : float, optional
+        Largest accepted absolute difference between two scores. The default
+        is 1e-9.
+    modes : iterable, optional
+        Scoring modes of the fast engine, from MODES (see fast_scores). The
+        submission and route scores of every gap penalty of a sweep are also
+        compared. The default is ('default',).
+    **options :
+        Options of score.evaluate, such as workers or cache_dir, used by the
+        fast engine.
+
+    Returns
+    -------
+    discrepancies : list
+        One dictionary per discrepancy, with the mode, the route (None for the
+        whole submission), the compared field, the value of each engine and
+        their difference, if numeric.
+
+    '''
+    references={1000:run(reference_scores,paths)}
+    discrepancies=[]
+    for mode in modes:
+        fast=run(fast_scores,paths,mode,**options)
+        discrepancies.extend(compare_scores(mode,expected_scores(references[1000],paths,mode),fast,tolerance))
+        if isinstance(fast,BaseException) or 'gap_sweep' not in fast:
+            continue
+        sweep=fast['gap_sweep']
+        for k,g in enumerate(sweep['gap_penalties']):
+            if g not in references:
+                references[g]=run(reference_scores,paths,g)
+            fast_g={
+                'submission_score':sweep['submission_scores'][k],
+                'route_scores':{route:route_sweep[k] for route,route_sweep in sweep['route_scores'].items()},
+                'route_feasibility':fast['route_feasibility']
+                }
+            discrepancies.extend(compare_scores('{} g={}'.format(mode,g),
+                expected_scores(references[g],paths,mode),fast_g,tolerance))
+    return sorted(discrepancies,key=lambda d: (d['mode'],d['route'] or '',d['field']))
+
+def expected_scores(ref,paths,mode):
+    # Sampled scores are compared with the same sample of the reference scores
+    if mode=='sample' and not isinstance(ref,BaseException):
+        return run(sampled_scores,ref,paths['actual_routes_json'])
+    return ref
+
+def run(function,*args,**kwargs):
+    try:
+        return function(*args,**kwargs)
+    except (Exception,SystemExit) as e:
+        # reference.read_json_data exits on unreadable files
+        return e
+
+def compare_scores(mode,ref,fast,tolerance):
+    if isinstance(ref,BaseException) or isinstance(fast,BaseException):
+        if isinstance(ref,BaseException) and isinstance(fast,BaseException):
+            return []
+        return [discrepancy(mode,None,'error',describe(ref),describe(fast))]
+    discrepancies=[]
+    if not close(ref['submission_score'],fast['submission_score'],tolerance):
+        discrepancies.append(discrepancy(mode,None,'submission_score',ref['submission_score'],fast['submission_score']))
+    for route in ref['route_scores'].keys()|fast['route_scores'].keys():
+        if route not in ref['route_scores'] or route not in fast['route_scores']:
+            discrepancies.append(discrepancy(mode,route,'route_scores',
+                ref['route_scores'].get(route),fast['route_scores'].get(route)))
+            continue
+        if not close(ref['route_scores'][route],fast['route_scores'][route],tolerance):
+            discrepancies.append(discrepancy(mode,route,'route_scores',
+                ref['route_scores'][route],fast['route_scores'][route]))
+        if ref['route_feasibility'][route]!=fast['route_feasibility'][route]:
+            discrepancies.append(discrepancy(mode,route,'route_feasibility',
+                ref['route_feasibility'][route],fast['route_feasibility'][route]))
+    return discrepancies
+
+def reference_scores(paths,g=1000):
+    '''
+    Scores inputs with the reference engine, with gap penalty g.
+
+    reference.evaluate always scores with the default gap penalty, so other
+    penalties are passed to reference.score by replacing it for the duration
+    of the call, which leaves the frozen reference unchanged.
+    '''
+    if g==1000:
+        return reference.evaluate(**paths)
+    score_route=reference.score
+    reference.score=lambda actual,sub,cost_mat: score_route(actual,sub,cost_mat,g)
+    try:
+        return reference.evaluate(**paths)
+    finally:
+        reference.score=score_route
+
+def sampled_scores(ref,actual_routes_json):
+    '''
+    Restricts the reference scores to the routes drawn by the sample mode,
+    with the submission score estimated from them as score.evaluate does.
+    '''
+    with open(actual_routes_json) as in_file:
+        actual_routes=json.load(in_file)
+    strata=sampling.stratify(actual_routes,station_codes(actual_routes))
+    drawn=sampling.draw_sample(strata,SAMPLE)
+    sampled_routes=set().union(*drawn.values())
+    routes=[route for route in actual_routes if route in sampled_routes]
+    return {
+        'submission_score':sampling.estimate(ref['route_scores'],strata,drawn)['submission_score'],
+        'route_scores':{route:ref['route_scores'][route] for route in routes},
+        'route_feasibility':{route:ref['route_feasibility'][route] for route in routes}
+        }
+
+def station_codes(routes):
+    # Two thirds of the routes in one station and the rest in another
+    return {route:STATION_CODES[i%len(STATION_CODES)] for i,route in enumerate(routes)}
+
+def fast_scores(paths,mode='default',**options):
+    '''
+    Scores inputs with the fast engine in one of MODES:
+    - default: score.evaluate
+    - cache: score.evaluate twice with the same cache_dir, the second run
+      reading the binary input cache written by the first
+    - shards: sharding.evaluate_sharded, with SHARDS shards then a merge
+    - sample: score.evaluate of a stratified sample of SAMPLE of the routes,
+      with the gap penalties of GAP_PENALTIES, each estimated from the sample,
+      and the stations of STATION_CODES in a route data file
+    - gap_sweep: score.evaluate with the gap penalties of GAP_PENALTIES
+    - incremental: score.evaluate with a route cache, after scoring the
+      submission without every other route, so that half of the routes are
+      reused from the cache and the others are scored
+    '''
+    with tempfile.TemporaryDirectory(prefix='rc-differential-') as tmp_dir:
+        if mode=='default':
+            return score.evaluate(**paths,**options)
+        elif mode=='cache':
+            options=dict(options,cache_dir=os.path.join(tmp_dir,'cache'))
+            score.evaluate(**paths,**options)
+            return score.evaluate(**paths,**options)
+        elif mode=='shards':
+            return sharding.evaluate_sharded(**paths,output_dir=tmp_dir,count=SHARDS,
+                workers=options.get('workers',1),validate=options.get('validate',True))
+        elif mode=='sample':
+            with open(paths['actual_routes_json']) as in_file:
+                routes=list(json.load(in_file))
+            route_data_json=os.path.join(tmp_dir,'route_data.json')
+            with open(route_data_json,'w') as out_file:
+                json.dump({route:{'station_code':code} for route,code in station_codes(routes).items()},out_file)
+            return score.evaluate(**paths,sample=SAMPLE,gap_penalties=GAP_PENALTIES,
+                route_data_json=route_data_json,**options)
+        elif mode=='gap_sweep':
+            return score.evaluate(**paths,gap_penalties=GAP_PENALTIES,**options)
+        elif mode=='incremental':
+            with open(paths['submission_json']) as in_file:
+                submission=json.load(in_file)
+            previous_json=os.path.join(tmp_dir,'previous_sequences.json')
+            with open(previous_json,'w') as out_file:
+                json.dump({route:value for i,(route,value) in enumerate(submission.items()) if i%2},out_file)
+            route_cache_json=os.path.join(tmp_dir,'route_scores_cache.json')
+            score.evaluate(**dict(paths,submission_json=previous_json),route_cache_json=route_cache_json,**options)
+            return score.evaluate(**paths,route_cache_json=route_cache_json,**options)
+        raise ValueError('Unknown scoring mode: {}'.format(mode))
+
+def close(a,b,tolerance):
+    # NaN scores only match NaN scores
+    if a!=a or b!=b:
+        return a!=a and b!=b
+    return a==b or abs(a-b)<=tolerance
+
+def describe(result):
+    if isinstance(result,BaseException):
+        return '{}: {}'.format(type(result).__name__,result)
+    return 'scored'
+
+def discrepancy(mode,route,field,reference_value,fast_value):
+    try:
+        difference=abs(fast_value-reference_value)
+    except TypeError:
+        difference=None
+    return {'mode':mode,'route':route,'field':field,'reference':reference_value,'fast':fast_value,'difference':difference}
+
+def perturb_inputs(paths,seed=0):
+    '''
+    Rewrites generated inputs to cover the edge cases of scoring: routes
+    missing from the submission, stop numbers that good_format replaces with
+    'invalid', repeated stop numbers, extra and missing stops, a station that
+    is not first, nearly identical sequences, and integer travel times that
+    make the edit distance choose between equal-cost edits.
+
+    Parameters
+    ----------
+    paths : dict
+        filepaths written by benchmark.generate_inputs.
+    seed : int, optional
+        Seed of the perturbations. The default is 0.
+
+    Returns
+    -------
+    None.
+
+    '''
+    rng=random.Random(seed)
+    with open(paths['submission_json']) as in_file:
+        submission=json.load(in_file)
+    with open(paths['cost_matrices_json']) as in_file:
+        cost_matrices=json.load(in_file)
+    for i,route in enumerate(sorted(submission)):
+        proposed=submission[route]['proposed']
+        stops=sorted(proposed,key=proposed.get)
+        case=i%8
+        if case==1:
+            del submission[route]
+            continue
+        elif case==2:
+            proposed[rng.choice(stops[1:])]=rng.choice([len(stops),-1,1.0,None,'1'])
+        elif case==3:
+            proposed[stops[-1]]=proposed[stops[1]]
+        elif case==4:
+            if rng.random()<0.5:
+                del proposed[stops[-1]]
+            else:
+                proposed[next(s for s in benchmark.STOP_IDS if s not in proposed)]=len(stops)
+        elif case==5:
+            j=rng.randrange(1,len(stops))
+            proposed[stops[0]],proposed[stops[j]]=j,0
+        elif case==6:
+            j=rng.randrange(1,len(stops)-1)
+            proposed[stops[j]],proposed[stops[j+1]]=j+1,j
+        if i%3==0:
+            for origin in cost_matrices[route]:
+                for dest in cost_matrices[route][origin]:
+                    if origin!=dest:
+                        cost_matrices[route][origin][dest]=rng.randint(1,5)
+    with open(paths['submission_json'],'w') as out_file:
+        json.dump(submission,out_file)
+    with open(paths['cost_matrices_json'],'w') as out_file:
+        json.dump(cost_matrices,out_file)
+
+def run_generated(seeds,routes=24,min_stops=10,max_stops=60,tolerance=1e-9,modes=('default',),**options):
+    '''
+    Compares both engines on generated inputs of every benchmark scenario,
+    with and without perturbations.
+
+    Parameters
+    ----------
+    seeds : iterable
+        Seeds of the generated inputs.
+    routes : int, optional
+        Number of routes of each input. The default is 24.
+    min_stops : int, optional
+        Minimum number of stops of a route. The default is 10.
+    max_stops : int, optional
+        Maximum number of stops of a route. The recursive reference engine is
+        slow on long routes. The default is 60.
+    tolerance : float, optional
+        Largest accepted absolute difference between two scores. The default
+        is 1e-9.
+    modes : iterable, optional
+        Scoring modes of the fast engine, from MODES. The default is
+        ('default',).
+    **options :
+        Options of score.evaluate used by the fast engine.
+
+    Returns
+    -------
+    report : list
+        (name of the inputs, discrepancies) pairs.
+
+    '''
+    report=[]
+    with tempfile.TemporaryDirectory(prefix='rc-differential-') as tmp_dir:
+        for seed in seeds:
+            for scenario in benchmark.SCENARIOS:
+                for perturbed in (False,True):
+                    paths=benchmark.generate_inputs(tmp_dir,scenario,routes,min_stops,max_stops,seed)
+                    if perturbed:
+                        perturb_inputs(paths,seed)
+                    name='{}{} seed {}'.format(scenario,' perturbed' if perturbed else '',seed)
+                    report.append((name,compare(paths,tolerance,modes,**options)))
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that score.py reproduces the scores of the reference engine.')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0],
+        help='seeds of the generated inputs (default: 0)')
+    parser.add_argument('--routes', type=int, default=24,
+        help='number of routes of each generated input (default: 24)')
+    parser.add_argument('--stops', type=int, nargs=2, default=[10,60], metavar=('MIN','MAX'),
+        help='range of the number of stops of a generated route (default: 10 60)')
+    parser.add_argument('--no-generated', action='store_true',
+        help='only compare the engines on the inputs and submission of the app')
+    parser.add_argument('--real', action='store_true',
+        help='also compare the engines on the inputs and submission of the app')
+    parser.add_argument('--tolerance', type=float, default=1e-9,
+        help='largest accepted absolute difference between two scores (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of processes used by the fast engine, 0 uses every CPU (default: 1)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES),
+        help='scoring modes of the fast engine to compare with the reference engine (default: all)')
+    args = parser.parse_args()
+    args.workers = args.workers or os.cpu_count()
+
+    report = []
+    if not args.no_generated:
+        report.extend(run_generated(args.seeds, args.routes, args.stops[0], args.stops[1],
+            args.tolerance, args.modes, workers=args.workers))
+    if args.real or args.no_generated:
+        report.append(('app inputs', compare(REAL_INPUTS, args.tolerance, args.modes, workers=args.workers)))
+
+    failed = 0
+    for name, discrepancies in report:
+        print("{:<40} {}".format(name, 'ok' if not discrepancies else '{} discrepancies'.format(len(discrepancies))))
+        for d in discrepancies:
+            print("    [{mode}] {route} {field}: reference={reference} fast={fast} difference={difference}".format(**d))
+        failed += bool(discrepancies)
+    print("\n{} of {} inputs with discrepancies".format(failed, len(report)))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,251 @@
+import numpy as np
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from collections.abc import Mapping
+# Import local score file
+import score
+from profiling import profiled
+
+# Bump when the layout of the cache changes
+CACHE_VERSION=1
+INVALID_POSITION=np.iinfo(np.int32).min
+HASH_DIR=re.compile(r'^[0-9a-f]{64}$')
+
+def load_ground_truth(actual_routes_json,cost_matrices_json,invalid_scores_json,cache_dir,keep_matrices=True,validate=True):
+    '''
+    Loads the ground truth of evaluate through a binary cache.
+
+    The cache lives in a subdirectory of cache_dir named after a hash of the
+    contents of the three input files. It is built, replacing any stale cache,
+    when no subdirectory matches. If cache_dir is not writable, the inputs are
+    loaded without caching, as score.load_ground_truth does with keep_matrices
+    and validate.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    cache_dir : str
+        Directory holding the cache.
+    keep_matrices : bool, optional
+        Used when the cache cannot be written, see score.load_ground_truth.
+        The default is True.
+    validate : bool, optional
+        Used when the cache cannot be written, see score.load_ground_truth.
+        The default is True.
+
+    Returns
+    -------
+    ground_truth : dict
+        Same as score.load_ground_truth, backed by memory-mapped arrays.
+
+    '''
+    sources=(actual_routes_json,cost_matrices_json,invalid_scores_json)
+    path=os.path.join(cache_dir,source_hash(*sources))
+    if not os.path.isdir(path):
+        try:
+            build_cache(path,*sources)
+        except OSError as e:
+            print("Unable to write the scoring cache in '{}', skipping it!".format(cache_dir))
+            print(e)
+            return score.load_ground_truth(*sources,keep_matrices=keep_matrices,validate=validate)
+    with profiled('load'):
+        return open_cache(path)
+
+def source_hash(*filepaths):
+    '''
+    Hashes the contents of the given files.
+
+    Parameters
+    ----------
+    *filepaths : str
+        Paths of the files, in a fixed order.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest, 64 characters long.
+
+    '''
+    digest=hashlib.blake2b(digest_size=32)
+    digest.update('rc-scoring-cache-{}'.format(CACHE_VERSION).encode())
+    for filepath in filepaths:
+        try:
+            with open(filepath,'rb') as in_file:
+                size=os.fstat(in_file.fileno()).st_size
+                digest.update(size.to_bytes(8,'little'))
+                for chunk in iter(lambda: in_file.read(1<<20),b''):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            # Let the loaders report the missing file
+            digest.update(b'missing')
+    return digest.hexdigest()
+
+def build_cache(path,actual_routes_json,cost_matrices_json,invalid_scores_json):
+    '''
+    Parses, checks and normalizes the ground truth and writes it to path.
+
+    The files are written to a temporary directory next to path, which is
+    then renamed, so a cache is either complete or absent. Other caches in
+    the same directory are removed.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache to build.
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+
+    Returns
+    -------
+    None.
+
+    '''
+    cache_dir=os.path.dirname(path)
+    os.makedirs(cache_dir,exist_ok=True)
+    tmp_path=tempfile.mkdtemp(prefix='.tmp-',dir=cache_dir)
+    try:
+        actual_routes=score.read_json_data(actual_routes_json)
+        score.good_format(actual_routes,'actual',actual_routes_json)
+        invalid_scores=score.read_json_data(invalid_scores_json)
+        score.good_format(invalid_scores,'invalids',invalid_scores_json)
+        # Matrices are appended in file order, one route at a time
+        matrix_slices={}
+        route_stops={}
+        offset=0
+        with open(os.path.join(tmp_path,'matrices.bin'),'wb') as out_file:
+            for route,stop_index,times in score.iter_cost_matrices(cost_matrices_json,actual_routes):
+                with profiled('normalize'):
+                    norm_mat=score.normalize_array(times)
+                out_file.write(norm_mat.tobytes())
+                matrix_slices[route]=(offset,len(stop_index))
+                route_stops[route]=list(stop_index)
+                offset+=norm_mat.size
+        routes=list(actual_routes)
+        actual_stops=[]
+        actual_positions=[]
+        actual_offsets=[0]
+        stops=[]
+        stop_offsets=[0]
+        matrix_offsets=[]
+        for route in routes:
+            sequence=actual_routes[route]['actual']
+            actual_stops.extend(sequence)
+            actual_positions.extend(INVALID_POSITION if position=='invalid' else position
+                for position in sequence.values())
+            actual_offsets.append(len(actual_stops))
+            stops.extend(route_stops.get(route,[]))
+            stop_offsets.append(len(stops))
+            # Routes without a matrix get -1 and raise KeyError when used
+            matrix_offsets.append(matrix_slices.get(route,(-1,0))[0])
+        arrays={
+            'routes':np.array(routes,dtype=str),
+            'actual_stops':np.array(actual_stops,dtype='U2'),
+            'actual_positions':np.array(actual_positions,dtype=np.int32),
+            'actual_offsets':np.array(actual_offsets,dtype=np.int64),
+            'stops':np.array(stops,dtype='U2'),
+            'stop_offsets':np.array(stop_offsets,dtype=np.int64),
+            'matrix_offsets':np.array(matrix_offsets,dtype=np.int64),
+            'invalid_routes':np.array(list(invalid_scores),dtype=str),
+            'invalid_scores':np.array(list(invalid_scores.values()),dtype=float)
+            }
+        for name,array in arrays.items():
+            np.save(os.path.join(tmp_path,name+'.npy'),array)
+        for name in os.listdir(cache_dir):
+            if HASH_DIR.match(name):
+                shutil.rmtree(os.path.join(cache_dir,name),ignore_errors=True)
+        os.rename(tmp_path,path)
+    finally:
+        shutil.rmtree(tmp_path,ignore_errors=True)
+
+def open_cache(path):
+    '''
+    Opens a cache written by build_cache.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache.
+
+    Returns
+    -------
+    ground_truth : dict
+        Actual routes (as CachedActualRoutes), cost matrices (as
+        CachedCostMatrices) and invalid scores.
+
+    '''
+    arrays={}
+    for name in os.listdir(path):
+        if name.endswith('.npy'):
+            arrays[name[:-4]]=np.load(os.path.join(path,name),mmap_mode='r')
+    matrices_path=os.path.join(path,'matrices.bin')
+    if os.path.getsize(matrices_path):
+        matrices=np.memmap(matrices_path,dtype=float,mode='r')
+    else:
+        matrices=np.empty(0)
+    routes=arrays['routes'].tolist()
+    invalid_scores=dict(zip(arrays['invalid_routes'].tolist(),arrays['invalid_scores'].tolist()))
+    return {
+        'actual_routes':CachedActualRoutes(routes,arrays),
+        'cost_matrices':CachedCostMatrices(routes,arrays,matrices),
+        'invalid_scores':invalid_scores
+        }
+
+class CachedActualRoutes(Mapping):
+    '''
+    Read-only mapping of route IDs to actual routes stored in a cache. Each
+    route's dictionary is rebuilt when it is requested.
+    '''
+    def __init__(self,routes,arrays):
+        self.routes={route:i for i,route in enumerate(routes)}
+        self.stops=arrays['actual_stops']
+        self.positions=arrays['actual_positions']
+        self.offsets=arrays['actual_offsets']
+
+    def __getitem__(self,route):
+        i=self.routes[route]
+        start,end=self.offsets[i],self.offsets[i+1]
+        positions=['invalid' if position==INVALID_POSITION else position
+            for position in self.positions[start:end].tolist()]
+        return {'actual':dict(zip(self.stops[start:end].tolist(),positions))}
+
+    def __iter__(self):
+        return iter(self.routes)
+
+    def __len__(self):
+        return len(self.routes)
+
+class CachedCostMatrices(score.CostMatrices):
+    '''
+    CostMatrices whose normalized matrices are views of a memory-mapped cache.
+    '''
+    def __init__(self,routes,arrays,matrices):
+        super().__init__()
+        self.routes={route:i for i,route in enumerate(routes)}
+        self.stops=arrays['stops']
+        self.stop_offsets=arrays['stop_offsets']
+        self.matrix_offsets=arrays['matrix_offsets']
+        self.matrices_data=matrices
+
+    def normalized(self,route):
+        if route not in self.cache:
+            i=self.routes[route]
+            offset=self.matrix_offsets[i]
+            if offset<0:
+                raise KeyError(route)
+            stops=self.stops[self.stop_offsets[i]:self.stop_offsets[i+1]].tolist()
+            n=len(stops)
+            norm_mat=self.matrices_data[offset:offset+n*n].reshape(n,n)
+            self.cache[route]=({stop:j for j,stop in enumerate(stops)},norm_mat)
+        return self.cache[route]
@@ -0,0 +1,125 @@
+import numpy as np
+import os
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Compiled kernels are used when Numba is installed, unless SCORING_JIT=0
+AVAILABLE=numba is not None and os.environ.get('SCORING_JIT','1')!='0'
+
+def erp_band(actual,sub,matrix,g,low,high):
+    '''
+    Compiled equivalent of score.erp_band.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route as integer stop indices.
+    sub : list
+        Submitted route as integer stop indices.
+    matrix : numpy.ndarray
+        Normalized dense cost matrix.
+    g : int/float
+        Gap penalty.
+    low : int
+        Smallest offset i-j in the band.
+    high : int
+        Largest offset i-j in the band.
+
+    Returns
+    -------
+    d : float
+        ERP from comparing sub to actual within the band.
+    count : int
+        Number of edits in that ERP.
+
+    '''
+    d,count=_erp_band(np.asarray(actual,dtype=np.int64),np.asarray(sub,dtype=np.int64),
+        np.asarray(matrix,dtype=float),float(g),low,high)
+    return d,int(count)
+
+def seq_dev_sum(sub_pos):
+    '''
+    Compiled sum of the absolute differences between consecutive positions,
+    minus one per pair, as in score.seq_dev_positions.
+
+    Parameters
+    ----------
+    sub_pos : list
+        Positions of the submitted stops in the actual route, without the
+        station.
+
+    Returns
+    -------
+    int
+        Sum of the deviations.
+
+    '''
+    return int(_seq_dev_sum(np.asarray(sub_pos,dtype=np.int64)))
+
+def _erp_band_py(actual,sub,matrix,g,low,high):
+    n=len(actual)
+    m=len(sub)
+    inf=np.inf
+    # Gap sums are accumulated one gap at a time, like score.gap_sum
+    gap_col=np.zeros(n+1)
+    for i in range(n-1,-1,-1):
+        gap_col[i]=gap_col[i+1]+g
+    next_d=np.zeros(m+1)
+    for j in range(m-1,-1,-1):
+        next_d[j]=next_d[j+1]+g
+    next_c=np.zeros(m+1,dtype=np.int64)
+    for j in range(m+1):
+        next_c[j]=m-j
+        if not low<=n-j<=high:
+            next_d[j]=inf
+    cur_d=np.empty(m+1)
+    cur_c=np.zeros(m+1,dtype=np.int64)
+    for i in range(n-1,-1,-1):
+        head_actual=actual[i]
+        cur_d[:]=inf
+        cur_c[:]=0
+        if low<=i-m<=high:
+            cur_d[m]=gap_col[i]
+            cur_c[m]=n-i
+        for j in range(min(m-1,i-low),max(0,i-high)-1,-1):
+            head_sub=sub[j]
+            option_1=next_d[j+1]+matrix[head_actual,head_sub]
+            option_2=next_d[j]+g
+            option_3=cur_d[j+1]+g
+            # Same comparisons as min, which keeps the first of equal or NaN options
+            d=option_1
+            if option_2<d:
+                d=option_2
+            if option_3<d:
+                d=option_3
+            if d==option_1:
+                if head_actual==head_sub:
+                    count=next_c[j+1]
+                else:
+                    count=next_c[j+1]+1
+            elif d==option_2:
+                count=next_c[j]+1
+            else:
+                count=cur_c[j+1]+1
+            cur_d[j]=d
+            cur_c[j]=count
+        next_d,cur_d=cur_d,next_d
+        next_c,cur_c=cur_c,next_c
+    return next_d[0],next_c[0]
+
+def _seq_dev_sum_py(positions):
+    total=0
+    for k in range(len(positions)-1):
+        total+=abs(positions[k+1]-positions[k])
+    return total-(len(positions)-1)
+
+if AVAILABLE:
+    # The numpy error model divides by zero like NumPy instead of raising
+    jit=numba.njit(cache=True,error_model='numpy')
+    _erp_band=jit(_erp_band_py)
+    _seq_dev_sum=jit(_seq_dev_sum_py)
+else:
+    _erp_band=_erp_band_py
+    _seq_dev_sum=_seq_dev_sum_py
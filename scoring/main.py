@@ -1,6 +1,16 @@
-import os, json, time
-# Import local score file
+import argparse, os, json, time
+# Import local score files
+import reference
 import score
+import sharding
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ACTUAL_ROUTES_JSON = os.path.join(BASE_DIR,'data/model_score_inputs/new_actual_sequences.json')
+INVALID_SCORES_JSON = os.path.join(BASE_DIR,'data/model_score_inputs/new_invalid_sequence_scores.json')
+SUBMISSION_JSON = os.path.join(BASE_DIR,'data/model_apply_outputs/proposed_sequences.json')
+COST_MATRICES_JSON = os.path.join(BASE_DIR,'data/model_apply_inputs/new_travel_times.json')
+ROUTE_DATA_JSON = os.path.join(BASE_DIR,'data/model_apply_inputs/new_route_data.json')
+OUTPUT_DIR = os.path.join(BASE_DIR,'data/model_score_outputs')
 
 # Read JSON data from the given filepath
 def read_json_data(filepath):
@@ -16,31 +26,62 @@ def read_json_data(filepath):
         print(e)
     return None
 
-if __name__ == '__main__':
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-
+# Score the submission of the app and print its route scores
+def run_single(args):
     # Read JSON time inputs
     model_build_time = read_json_data(os.path.join(BASE_DIR,'data/model_score_timings/model_build_time.json'))
     model_apply_time = read_json_data(os.path.join(BASE_DIR,'data/model_score_timings/model_apply_time.json'))
 
     print('Beginning Score Evaluation... ', end='')
-    output = score.evaluate(
-        actual_routes_json = os.path.join(BASE_DIR,'data/model_score_inputs/new_actual_sequences.json'),
-        invalid_scores_json = os.path.join(BASE_DIR,'data/model_score_inputs/new_invalid_sequence_scores.json'),
-        submission_json = os.path.join(BASE_DIR,'data/model_apply_outputs/proposed_sequences.json'),
-        cost_matrices_json = os.path.join(BASE_DIR,'data/model_apply_inputs/new_travel_times.json'),
+    if args.shards:
+        options = {
+            'output_dir': args.shard_dir,
+            'count': args.shards
+        }
+        if args.merge:
+            evaluate = sharding.merge_shards
+        else:
+            options.update(workers=args.workers, validate=not args.skip_validation)
+            evaluate = sharding.evaluate_sharded
+    elif args.engine == 'reference':
+        # The reference engine has none of the options of the fast engine
+        options = {}
+        evaluate = reference.evaluate
+    else:
+        options = {
+            'workers': args.workers,
+            'cache_dir': args.cache_dir,
+            'validate': not args.skip_validation,
+            'route_cache_json': os.path.join(OUTPUT_DIR,'route_scores_cache.json') if args.incremental else None,
+            'profile': args.profile,
+            'gap_penalties': args.gap_sweep,
+            'sample': args.sample,
+            'sample_seed': args.sample_seed,
+            'route_data_json': ROUTE_DATA_JSON if os.path.exists(ROUTE_DATA_JSON) else None
+        }
+        evaluate = score.evaluate
+    output = evaluate(
+        actual_routes_json = ACTUAL_ROUTES_JSON,
+        invalid_scores_json = INVALID_SCORES_JSON,
+        submission_json = SUBMISSION_JSON,
+        cost_matrices_json = COST_MATRICES_JSON,
         model_apply_time = model_apply_time.get("time"),
-        model_build_time = model_build_time.get("time")
+        model_build_time = model_build_time.get("time"),
+        **options
     )
     print('done')
 
     # Write Outputs to File
-    output_path = os.path.join(BASE_DIR,'data/model_score_outputs/scores.json')
+    output_path = os.path.join(OUTPUT_DIR,'scores.json')
     with open(output_path, 'w') as out_file:
         json.dump(output, out_file)
 
     # Print Pretty Output
     print("\nsubmission_score:", output.get('submission_score'))
+    if 'sample' in output:
+        sample = output['sample']
+        print("Estimated from {} of {} routes ({:.1%}), {:.0%} confidence interval: [{}, {}]".format(
+            sample['sampled_routes'], sample['routes'], sample['fraction'], sample['confidence'], *sample['confidence_interval']))
     rt_show=output.get('route_scores')
     extra_str=None
     if len(rt_show.keys())>5:
@@ -53,3 +94,151 @@ if __name__ == '__main__':
         print(rt_key,": ",rt_score)
     if extra_str:
         print(extra_str)
+    if 'gap_sweep' in output:
+        print("\nSubmission score by gap penalty:")
+        for k, (g, g_score) in enumerate(zip(output['gap_sweep']['gap_penalties'], output['gap_sweep']['submission_scores'])):
+            if 'confidence_intervals' in output['gap_sweep']:
+                print("g={:<10} {} [{}, {}]".format(g, g_score, *output['gap_sweep']['confidence_intervals'][k]))
+            else:
+                print("g={:<10} {}".format(g, g_score))
+    if 'profile' in output:
+        print_profile(output['profile'])
+
+# Print the phase timings, peak memory and slowest routes of a profiled scoring
+def print_profile(profile):
+    print("\nProfile ({:.3f} s):".format(profile['total_seconds']))
+    for phase, seconds in profile['phase_seconds'].items():
+        print("{:<12} {:>10.3f} s".format(phase, seconds))
+    memory = profile.get('peak_memory_mb')
+    if memory:
+        print("Peak memory: {:.1f} MB (workers: {:.1f} MB)".format(memory['self'], memory['children']))
+    print("\nSlowest routes:")
+    for route in profile['slowest_routes']:
+        print("{} ({} stops): {:.4f} s".format(route['route'], route['stops'], route['seconds']))
+
+# Score a single shard of the routes, leaving the merge to another run
+def run_shard(args):
+    print('Beginning Shard {} of {} Evaluation... '.format(args.shard, args.shards), end='')
+    path, skipped = sharding.score_shard(
+        actual_routes_json = ACTUAL_ROUTES_JSON,
+        invalid_scores_json = INVALID_SCORES_JSON,
+        submission_json = SUBMISSION_JSON,
+        cost_matrices_json = COST_MATRICES_JSON,
+        output_dir = args.shard_dir,
+        index = args.shard,
+        count = args.shards,
+        validate = not args.skip_validation
+    )
+    print('already complete' if skipped else 'done')
+    print("\nShard results saved to '{}'".format(path))
+
+# Keep the inputs loaded and score submissions sent to a local server
+def run_server(args):
+    import server
+    print('Loading Scoring Inputs... ', end='')
+    service = server.ScoringService(
+        actual_routes_json = ACTUAL_ROUTES_JSON,
+        invalid_scores_json = INVALID_SCORES_JSON,
+        cost_matrices_json = COST_MATRICES_JSON,
+        workers = args.workers,
+        cache_dir = args.cache_dir,
+        validate = not args.skip_validation
+    )
+    print('done')
+    server.serve(service, port=args.port, socket_path=args.socket)
+
+# Score several submissions against the same inputs and print a summary table
+def run_batch(args):
+    print('Beginning Batch Score Evaluation... ', end='')
+    summary = score.evaluate_batch(
+        actual_routes_json = ACTUAL_ROUTES_JSON,
+        invalid_scores_json = INVALID_SCORES_JSON,
+        submission_jsons = args.batch,
+        cost_matrices_json = COST_MATRICES_JSON,
+        output_dir = args.batch_output,
+        workers = args.workers,
+        cache_dir = args.cache_dir,
+        validate = not args.skip_validation,
+        gap_penalties = args.gap_sweep
+    )
+    print('done')
+
+    print("\n{:<40} {:>20} {:>16}".format('submission', 'submission_score', 'feasible_routes'))
+    for row in summary:
+        print("{:<40} {:>20} {:>16}".format(
+            os.path.basename(row['submission']),
+            row['submission_score'],
+            '{}/{}'.format(row['feasible_routes'], row['routes'])
+        ))
+    print("\nScores saved to '{}'".format(args.batch_output))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score the proposed sequences of a model.')
+    parser.add_argument('--engine', choices=['reference','fast'], default='fast',
+        help='score with the optimized engine or with the frozen original implementation (default: fast)')
+    parser.add_argument('--workers', type=int, default=1,
+        help='number of processes used to score routes, 0 uses every CPU (default: 1)')
+    parser.add_argument('--cache-dir', default=os.path.join(OUTPUT_DIR,'.score_cache'),
+        help='directory of the binary cache of parsed scoring inputs (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+        help='parse the scoring inputs without reading or writing the cache')
+    parser.add_argument('--skip-validation', action='store_true',
+        help='do not check the format of inputs other than the submission, for inputs that already passed')
+    parser.add_argument('--incremental', action='store_true',
+        help='only score routes whose proposed sequence changed since the last scoring, reusing the others')
+    parser.add_argument('--profile', type=int, nargs='?', const=10, default=0, metavar='N',
+        help='add phase timings, peak memory and the N slowest routes (default N: 10) to the scores')
+    parser.add_argument('--gap-sweep', type=float, nargs='+', metavar='G',
+        help='also score with each of these ERP gap penalties, in a single pass per route')
+    parser.add_argument('--sample', type=float, metavar='FRACTION',
+        help='estimate the submission score from a stratified sample of this fraction of the routes')
+    parser.add_argument('--sample-seed', type=int, default=0,
+        help='seed of the route sample and of its confidence interval (default: %(default)s)')
+    parser.add_argument('--shards', type=int, metavar='N',
+        help='score the routes in N shards, each saved to its own file, skipping shards completed by a previous run')
+    parser.add_argument('--shard', type=int, metavar='I',
+        help='with --shards, only score shard I (0 to N-1), for example on another host')
+    parser.add_argument('--merge', action='store_true',
+        help='with --shards, only merge the results of every shard')
+    parser.add_argument('--shard-dir', default=os.path.join(OUTPUT_DIR,'shards'),
+        help='directory of the results of each shard (default: %(default)s)')
+    parser.add_argument('--serve', action='store_true',
+        help='keep the inputs loaded and score the submissions posted to a local server')
+    parser.add_argument('--port', type=int, default=8642,
+        help='port of the server on localhost (default: %(default)s)')
+    parser.add_argument('--socket', metavar='PATH',
+        help='serve on this Unix socket instead of a localhost port')
+    parser.add_argument('--batch', nargs='+', metavar='PATH',
+        help='score these submission files, or every JSON file of these directories, instead of the app submission')
+    parser.add_argument('--batch-output', default=os.path.join(OUTPUT_DIR,'batch'),
+        help='directory of the scores and summary table of a batch (default: %(default)s)')
+    args = parser.parse_args()
+    args.workers = args.workers or os.cpu_count()
+    if args.no_cache:
+        args.cache_dir = None
+
+    if args.gap_sweep and args.incremental:
+        parser.error('--gap-sweep cannot be combined with --incremental')
+    if args.sample is not None and not 0 < args.sample <= 1:
+        parser.error('--sample must be in (0, 1]')
+    if args.sample is not None and (args.batch or args.serve):
+        parser.error('--sample cannot be combined with --batch or --serve')
+    if (args.batch or args.serve) and args.engine == 'reference':
+        parser.error('--batch and --serve are only available with the fast engine')
+    if (args.shard is not None or args.merge) and not args.shards:
+        parser.error('--shard and --merge require --shards')
+    if args.shards is not None and args.shards < 1:
+        parser.error('--shards must be positive')
+    if args.shards and (args.batch or args.serve or args.sample is not None or args.gap_sweep
+            or args.incremental or args.profile or args.engine == 'reference'):
+        parser.error('--shards cannot be combined with other scoring modes')
+    if args.shard is not None and not 0 <= args.shard < args.shards:
+        parser.error('--shard must be between 0 and N-1')
+    if args.serve:
+        run_server(args)
+    elif args.shard is not None:
+        run_shard(args)
+    elif args.batch:
+        run_batch(args)
+    else:
+        run_single(args)
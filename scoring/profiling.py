@@ -0,0 +1,174 @@
+import heapq
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Phases reported in the 'profile' section of scores.json
+PHASES=('load','validate','normalize','erp','seq_dev')
+
+_current=None
+_no_phase=nullcontext()
+
+class Profile:
+    '''
+    Accumulates high-resolution wall-clock time per scoring phase and per
+    route.
+
+    Phases are exclusive: time spent in a phase entered while another one is
+    running is only charged to the inner phase.
+
+    Parameters
+    ----------
+    slowest : int, optional
+        Number of slowest routes to report. The default is 10.
+
+    '''
+    def __init__(self,slowest=10):
+        self.slowest=slowest
+        self.phases=dict.fromkeys(PHASES,0.0)
+        self.routes=[]
+        self.stack=[]
+        self.start=time.perf_counter()
+
+    @contextmanager
+    def phase(self,name):
+        now=time.perf_counter()
+        if self.stack:
+            self.phases[self.stack[-1][0]]+=now-self.stack[-1][1]
+        self.stack.append([name,now])
+        try:
+            yield
+        finally:
+            now=time.perf_counter()
+            inner,started=self.stack.pop()
+            self.phases[inner]+=now-started
+            if self.stack:
+                self.stack[-1][1]=now
+
+    def add_route(self,route,stops,seconds):
+        '''
+        Records the time spent scoring a route.
+
+        Parameters
+        ----------
+        route : str
+            Route ID.
+        stops : int
+            Number of stops of the route.
+        seconds : float
+            Wall-clock time spent scoring the route.
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.routes.append((seconds,stops,route))
+        if len(self.routes)>2*max(self.slowest,1):
+            self.routes=heapq.nlargest(self.slowest,self.routes)
+
+    def merge(self,other):
+        '''
+        Adds the phases and routes recorded by another profile, such as the
+        profile of a worker process, given as returned by dump.
+
+        Parameters
+        ----------
+        other : dict
+            Dumped profile.
+
+        Returns
+        -------
+        None.
+
+        '''
+        for name,seconds in other['phases'].items():
+            self.phases[name]+=seconds
+        for route in other['routes']:
+            self.add_route(route[2],route[1],route[0])
+
+    def dump(self):
+        '''
+        Returns the raw recorded data, to be merged in another profile.
+        '''
+        return {'phases':self.phases,'routes':heapq.nlargest(self.slowest,self.routes)}
+
+    def report(self):
+        '''
+        Summarizes the profile.
+
+        Returns
+        -------
+        dict
+            Total and per-phase seconds, peak resident memory of this process
+            and of its finished children in MB, and the slowest routes with
+            their number of stops and seconds.
+
+        '''
+        return {
+            'total_seconds':time.perf_counter()-self.start,
+            'phase_seconds':dict(self.phases),
+            'peak_memory_mb':peak_memory_mb(),
+            'slowest_routes':[
+                {'route':route,'stops':stops,'seconds':seconds}
+                for seconds,stops,route in heapq.nlargest(self.slowest,self.routes)
+                ]
+            }
+
+def peak_memory_mb():
+    '''
+    Returns the peak resident memory of the process and of its children, in
+    MB, or None where the resource module is not available.
+    '''
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit=1 if sys.platform=='darwin' else 1024
+    return {
+        'self':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*unit/2**20,
+        'children':resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*unit/2**20
+        }
+
+def current():
+    '''
+    Returns the active profile, or None when not profiling.
+    '''
+    return _current
+
+def profiled(name):
+    '''
+    Context manager charging its body to a phase of the active profile. Does
+    nothing when not profiling.
+
+    Parameters
+    ----------
+    name : str
+        Phase, one of PHASES.
+
+    '''
+    if _current is None:
+        return _no_phase
+    return _current.phase(name)
+
+@contextmanager
+def profiling(profile):
+    '''
+    Makes a profile active for the duration of the context.
+
+    Parameters
+    ----------
+    profile : Profile/None
+        Profile to activate. Nothing is recorded if None.
+
+    '''
+    global _current
+    previous=_current
+    _current=profile
+    try:
+        yield profile
+    finally:
+        _current=previous
@@ -0,0 +1,151 @@
+import numpy as np
+# Import local score file
+import score
+
+def load_station_codes(route_data_json,routes=None):
+    '''
+    Reads the station code of each route of a route data file, without
+    keeping the stops of the whole file in memory.
+
+    Parameters
+    ----------
+    route_data_json : str
+        filepath of JSON of route data.
+    routes : container, optional
+        If given, only these routes are read. The default is None.
+
+    Returns
+    -------
+    station_codes : dict
+        Route ID to station code, or None where it is missing.
+
+    '''
+    return {route:data.get('station_code') if type(data)==dict else None
+        for route,data in score.read_json_items(route_data_json,routes)}
+
+def stratify(actual_routes,station_codes=None,stop_bins=4):
+    '''
+    Groups routes by station and number of stops.
+
+    Parameters
+    ----------
+    actual_routes : dict
+        Actual routes.
+    station_codes : dict, optional
+        Route ID to station code. If None, routes are only grouped by number
+        of stops. The default is None.
+    stop_bins : int, optional
+        Number of groups of routes by number of stops, with cut points at
+        quantiles over every route. The default is 4.
+
+    Returns
+    -------
+    strata : dict
+        (station code, stop bin) to list of route IDs, in the order of
+        actual_routes.
+
+    '''
+    stops={route:len(actual_routes[route]['actual']) for route in actual_routes}
+    if not stops:
+        return {}
+    edges=np.quantile(list(stops.values()),np.linspace(0,1,stop_bins+1)[1:-1])
+    strata={}
+    for route in actual_routes:
+        station_code=station_codes.get(route) if station_codes else None
+        stop_bin=int(np.searchsorted(edges,stops[route],side='right'))
+        strata.setdefault((station_code,stop_bin),[]).append(route)
+    return strata
+
+def draw_sample(strata,fraction,seed=0):
+    '''
+    Draws the same fraction of routes from every stratum, and at least two,
+    so that the spread of every stratum can be estimated.
+
+    Parameters
+    ----------
+    strata : dict
+        Strata, as returned by stratify.
+    fraction : float
+        Fraction of the routes of each stratum to draw, between 0 and 1.
+    seed : int, optional
+        Seed of the draw. The same seed and strata always give the same
+        sample. The default is 0.
+
+    Returns
+    -------
+    sample : dict
+        Stratum to list of drawn route IDs, in the order of the stratum.
+
+    '''
+    if not 0<fraction<=1:
+        raise ValueError('The sampled fraction of routes must be in (0, 1], not {}'.format(fraction))
+    rng=np.random.default_rng(seed)
+    sample={}
+    for stratum in sorted(strata,key=str):
+        routes=strata[stratum]
+        size=min(len(routes),max(2,round(fraction*len(routes))))
+        drawn=np.sort(rng.choice(len(routes),size,replace=False))
+        sample[stratum]=[routes[i] for i in drawn]
+    return sample
+
+def estimate(route_scores,strata,sample,seed=0,confidence=0.95,resamples=1000):
+    '''
+    Estimates the submission score from the scores of a stratified sample,
+    with a bootstrap confidence interval.
+
+    The estimate weights the mean score of each stratum by its share of the
+    routes. The interval resamples the scores of each stratum with
+    replacement, except for strata that were entirely scored, whose mean is
+    exact.
+
+    Parameters
+    ----------
+    route_scores : dict
+        Route ID to score, for every sampled route.
+    strata : dict
+        Strata, as returned by stratify.
+    sample : dict
+        Sample, as returned by draw_sample.
+    seed : int, optional
+        Seed of the bootstrap. The default is 0.
+    confidence : float, optional
+        Confidence level of the interval. The default is 0.95.
+    resamples : int, optional
+        Number of bootstrap resamples. The default is 1000.
+
+    Returns
+    -------
+    summary : dict
+        Estimated submission score, confidence interval, fraction of routes
+        scored, and size of each stratum and of its sample.
+
+    '''
+    total=sum(len(routes) for routes in strata.values())
+    rng=np.random.default_rng(seed)
+    submission_score=0.0
+    bootstrap=np.zeros(resamples)
+    summary_strata=[]
+    for stratum,routes in sample.items():
+        weight=len(strata[stratum])/total
+        scores=np.array([route_scores[route] for route in routes],dtype=float)
+        submission_score+=weight*scores.mean()
+        if len(routes)<len(strata[stratum]):
+            bootstrap+=weight*scores[rng.integers(0,len(scores),(resamples,len(scores)))].mean(axis=1)
+        else:
+            bootstrap+=weight*scores.mean()
+        summary_strata.append({
+            'station_code':stratum[0],
+            'stop_bin':stratum[1],
+            'routes':len(strata[stratum]),
+            'sampled_routes':len(routes)
+            })
+    scored=sum(len(routes) for routes in sample.values())
+    return {
+        'submission_score':submission_score,
+        'confidence':confidence,
+        'confidence_interval':np.quantile(bootstrap,[(1-confidence)/2,(1+confidence)/2]).tolist(),
+        'routes':total,
+        'sampled_routes':scored,
+        'fraction':scored/total,
+        'strata':summary_strata
+        }
@@ -1,6 +1,17 @@
 import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import hashlib
 import json
+import os
+import re
 import sys
+import time
+# Import local kernels and profiling files
+import kernels
+from profiling import Profile, profiled, profiling
+import profiling as _profiling
 
 def read_json_data(filepath):
     '''
@@ -24,7 +35,7 @@ def read_json_data(filepath):
 
     '''
     try:
-        with open(filepath, newline = '') as in_file:
+        with profiled('load'), open(filepath, newline = '') as in_file:
             file=json.load(in_file)
             in_file.close()
     except FileNotFoundError:
@@ -36,6 +47,110 @@ def read_json_data(filepath):
         sys.exit()
     return file
 
+def read_json_items(filepath,keys=None,chunk_size=1<<20):
+    '''
+    Streams the top-level entries of a JSON object file one at a time.
+
+    Only the entry being decoded and a read buffer are held in memory, so
+    large files can be processed with memory bounded by their largest entry.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of desired file.
+    keys : container, optional
+        If given, entries whose key is not in keys are skipped. The default
+        is None.
+    chunk_size : int, optional
+        Number of characters read from the file at a time. The default is
+        1 MiB.
+
+    Yields
+    ------
+    key : str
+        Key of the entry.
+    value : object
+        Decoded value of the entry.
+
+    '''
+    decoder=json.JSONDecoder()
+    whitespace=re.compile(r'\s*')
+    delimiters=' \t\n\r,:]}'
+    try:
+        with open(filepath, newline = '') as in_file:
+            buf=''
+            pos=0
+            eof=False
+
+            def fill(pos):
+                # Drop consumed text and read at least as much as is buffered
+                nonlocal buf,eof
+                data=in_file.read(max(chunk_size,len(buf)-pos))
+                eof=not data
+                buf=buf[pos:]+data
+                return 0
+
+            def skip(pos):
+                while True:
+                    pos=whitespace.match(buf,pos).end()
+                    if pos<len(buf) or eof:
+                        return pos
+                    pos=fill(pos)
+
+            def decode(pos):
+                while True:
+                    try:
+                        value,end=decoder.raw_decode(buf,pos)
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    else:
+                        # A number cut by the end of the buffer, like "12." or
+                        # "12e", still decodes, so check it is followed by a
+                        # delimiter
+                        if eof or (end<len(buf) and buf[end] in delimiters):
+                            return value,end
+                    pos=fill(pos)
+
+            pos=skip(fill(pos))
+            if buf[pos:pos+1]!='{':
+                raise json.JSONDecodeError('Expecting \'{\'',buf,pos)
+            pos=skip(pos+1)
+            if buf[pos:pos+1]=='}':
+                return
+            while True:
+                key,pos=decode(pos)
+                if type(key)!=str:
+                    raise json.JSONDecodeError('Expecting property name',buf,pos)
+                pos=skip(pos)
+                if buf[pos:pos+1]!=':':
+                    raise json.JSONDecodeError('Expecting \':\' delimiter',buf,pos)
+                value,pos=decode(skip(pos+1))
+                if keys is None or key in keys:
+                    yield key,value
+                del value
+                pos=skip(pos)
+                if buf[pos:pos+1]=='}':
+                    return
+                if buf[pos:pos+1]!=',':
+                    raise json.JSONDecodeError('Expecting \',\' delimiter',buf,pos)
+                pos=skip(pos+1)
+    except FileNotFoundError:
+        print("The '{}' file is missing!".format(filepath))
+        sys.exit()
+    except Exception as e:
+        print("Error when reading the '{}' file!".format(filepath))
+        print(e)
+        sys.exit()
+
+class JSONDecodeError(Exception):
+    pass
+
+# Bump when route scores computed by an older version must not be reused
+ROUTE_CACHE_VERSION=1
+
+NUMBER_TYPES={int,float}
+
 def good_format(file,input_type,filepath):
     '''
     Checks if input dictionary has proper formatting.
@@ -54,58 +169,121 @@ def good_format(file,input_type,filepath):
     ------
     JSONDecodeError
         The file exists and is readable, but it does not have the proper
-        formatting for its place in the inputs of evaluate.
+        formatting for its place in the inputs of evaluate. The message lists
+        every violation found, with its location.
 
     Returns
     -------
     None.
 
     '''
-    
+    with profiled('validate'):
+        errors=format_errors(file,input_type,filepath)
+    if errors:
+        raise JSONDecodeError('\n'.join(errors))
+
+def format_errors(file,input_type,filepath):
+    '''
+    Finds every formatting violation of an input dictionary in a single pass.
+
+    Stop numbers of sequences that are not integers or that are out of range
+    are replaced with 'invalid', as they make the route invalid rather than
+    the file. Type and length checks run over whole rows at a time, and only
+    rows that fail are walked again to locate the violations.
+
+    Parameters
+    ----------
+    file : dict
+        Dictionary loaded from evaluate input file.
+    input_type : str
+        Indicates which input of evaluate the current file is. Can be
+        "actual," "proposed," "costs," or "invalids."
+    filepath : str
+        Path from which file was loaded.
+
+    Returns
+    -------
+    errors : list
+        One message per violation. Empty if file is properly formatted.
+
+    '''
+    errors=[]
+    def error(message,*location):
+        errors.append('{} [{}]'.format(message.format(filepath),', '.join(location)))
+    bad_stop='Improper stop ID in {}. Each stop must be denoted by a two-letter ID string.'
     for route in file:
-        if route[:8]!='RouteID_':
-            raise JSONDecodeError('Improper route ID in {}. Every route must be denoted by a string that begins with "RouteID_".'.format(filepath))
+        if type(route)!=str or route[:8]!='RouteID_':
+            error('Improper route ID in {}. Every route must be denoted by a string that begins with "RouteID_".','route {!r}'.format(route))
     if input_type=='proposed' or input_type=='actual':
-        for route in file:
-            if type(file[route])!=dict or len(file[route])!=1: 
-                raise JSONDecodeError('Improper route in {}. Each route ID must map to a dictionary with a single key.'.format(filepath))
-            if input_type not in file[route]:
+        for route,route_dict in file.items():
+            where='route {!r}'.format(route)
+            if type(route_dict)!=dict or len(route_dict)!=1:
+                error('Improper route in {}. Each route ID must map to a dictionary with a single key.',where)
+                continue
+            if input_type not in route_dict:
                 if input_type=='proposed':
-                    raise JSONDecodeError('Improper route in {}. Each route\'s dictionary in a proposed sequence file must have the key, "proposed".'.format(filepath))
+                    error('Improper route in {}. Each route\'s dictionary in a proposed sequence file must have the key, "proposed".',where)
                 else:
-                    raise JSONDecodeError('Improper route in {}. Each route\'s dictionary in an actual sequence file must have the key, "actual".'.format(filepath))
-            if type(file[route][input_type])!=dict:
-                raise JSONDecodeError('Improper route in {}. Each sequence must be in the form of a dictionary.'.format(filepath))
-            num_stops=len(file[route][input_type])
-            for stop in file[route][input_type]:
+                    error('Improper route in {}. Each route\'s dictionary in an actual sequence file must have the key, "actual".',where)
+                continue
+            stops=route_dict[input_type]
+            if type(stops)!=dict:
+                error('Improper route in {}. Each sequence must be in the form of a dictionary.',where)
+                continue
+            num_stops=len(stops)
+            for stop,stop_num in stops.items():
                 if type(stop)!=str or len(stop)!=2:
-                    raise JSONDecodeError('Improper stop ID in {}. Each stop must be denoted by a two-letter ID string.'.format(filepath))
-                stop_num=file[route][input_type][stop]
+                    error(bad_stop,where,'stop {!r}'.format(stop))
                 if type(stop_num)!=int or stop_num>=num_stops:
-                    file[route][input_type][stop]='invalid'
+                    stops[stop]='invalid'
     if input_type=='costs':
-        for route in file:
-            if type(file[route])!=dict:
-                raise JSONDecodeError('Improper matrix in {}. Each cost matrix must be a dictionary.'.format(filepath)) 
-            for origin in file[route]:
-                if type(origin)!=str or len(origin)!=2:
-                    raise JSONDecodeError('Improper stop ID in {}. Each stop must be denoted by a two-letter ID string.'.format(filepath))
-                if type(file[route][origin])!=dict:
-                    raise JSONDecodeError('Improper matrix in {}. Each origin in a cost matrix must map to a dictionary of destinations'.format(filepath))
-                for dest in file[route][origin]:
-                    if type(dest)!=str or len(dest)!=2:
-                        raise JSONDecodeError('Improper stop ID in {}. Each stop must be denoted by a two-letter ID string.'.format(filepath))
-                    if not(type(file[route][origin][dest])==float or type(file[route][origin][dest])==int):
-                        raise JSONDecodeError('Improper time in {}. Every travel time must be a float or int.'.format(filepath))
+        for route,mat in file.items():
+            where='route {!r}'.format(route)
+            if type(mat)!=dict:
+                error('Improper matrix in {}. Each cost matrix must be a dictionary.',where)
+                continue
+            if not are_stop_ids(mat):
+                for origin in mat:
+                    if not are_stop_ids((origin,)):
+                        error(bad_stop,where,'origin {!r}'.format(origin))
+            for origin,dests in mat.items():
+                if type(dests)!=dict:
+                    error('Improper matrix in {}. Each origin in a cost matrix must map to a dictionary of destinations',where,'origin {!r}'.format(origin))
+                    continue
+                # Rows usually have the same stops as the origins, checked above
+                if dests.keys()!=mat.keys() and not are_stop_ids(dests):
+                    for dest in dests:
+                        if not are_stop_ids((dest,)):
+                            error(bad_stop,where,'origin {!r}'.format(origin),'destination {!r}'.format(dest))
+                if not set(map(type,dests.values()))<=NUMBER_TYPES:
+                    for dest,time in dests.items():
+                        if type(time) not in NUMBER_TYPES:
+                            error('Improper time in {}. Every travel time must be a float or int.',where,'origin {!r}'.format(origin),'destination {!r}'.format(dest))
     if input_type=='invalids':
-        for route in file:
-            if not(type(file[route])==float or type(file[route])==int):
-                raise JSONDecodeError('Improper score in {}. Every score in an invalid score file must be a float or int.'.format(filepath))
+        if not set(map(type,file.values()))<=NUMBER_TYPES:
+            for route,invalid_score in file.items():
+                if type(invalid_score) not in NUMBER_TYPES:
+                    error('Improper score in {}. Every score in an invalid score file must be a float or int.','route {!r}'.format(route))
+    return errors
 
-class JSONDecodeError(Exception):
-    pass
+def are_stop_ids(stops):
+    '''
+    Checks if every element of an iterable is a two-letter stop ID string.
+
+    Parameters
+    ----------
+    stops : iterable
+        Stop IDs, such as the keys of a sequence or cost matrix dictionary.
 
-def evaluate(actual_routes_json,submission_json,cost_matrices_json, invalid_scores_json,**kwargs):
+    Returns
+    -------
+    bool
+        True if every element is a string of length 2.
+
+    '''
+    return set(map(type,stops))<={str} and set(map(len,stops))<={2}
+
+def evaluate(actual_routes_json,submission_json,cost_matrices_json, invalid_scores_json,workers=1,cache_dir=None,validate=True,route_cache_json=None,profile=0,gap_penalties=None,sample=None,sample_seed=0,route_data_json=None,**kwargs):
     '''
     Calculates score for a submission.
 
@@ -119,6 +297,47 @@ def evaluate(actual_routes_json,submission_json,cost_matrices_json, invalid_scor
         filepath of JSON of estimated times to travel between stops of routes.
     invalid_scores_json : str
         filepath of JSON of scores assigned to routes if they are invalid.
+    workers : int, optional
+        Number of processes used to score routes. The default is 1.
+    cache_dir : str, optional
+        If given, the parsed and normalized inputs other than the submission
+        are loaded through a binary cache in this directory (see
+        input_cache.py). The default is None.
+    validate : bool, optional
+        If False, the inputs other than the submission are not checked with
+        good_format. Inputs read from the cache were checked when it was built
+        and are never checked again. The default is True.
+    route_cache_json : str, optional
+        If given, per-route results are kept in this file, and only routes
+        whose proposed sequence changed since the last scoring against the
+        same inputs are scored again. The default is None.
+    profile : int, optional
+        If positive, a 'profile' section is added to the output with the
+        seconds spent loading, validating and normalizing inputs and computing
+        ERP and sequence deviations, the peak memory, and the number of stops
+        and seconds of the profile slowest routes. With several workers,
+        route phases are summed over processes. The default is 0.
+    gap_penalties : list, optional
+        If given, a 'gap_sweep' section is added to the output with the
+        scores of the submission and of each route for each of these ERP gap
+        penalties, computed in a single pass per route (see score_submission).
+        Cannot be combined with route_cache_json. The default is None.
+    sample : float, optional
+        If given, only this fraction of the routes is scored, drawn from
+        strata of routes with the same station and a similar number of stops
+        (see sampling.py). The submission score is then estimated from the
+        stratum means, route_scores and route_feasibility only hold the
+        sampled routes, and a 'sample' section reports a bootstrap 95%
+        confidence interval of the submission score and the fraction of
+        routes scored. With gap_penalties, the submission score of each
+        penalty is estimated the same way, and 'gap_sweep' also holds their
+        'confidence_intervals'. The default is None, which scores every route.
+    sample_seed : int, optional
+        Seed of the sample and of the bootstrap. The default is 0.
+    route_data_json : str, optional
+        filepath of JSON of route data, whose station codes are used to
+        stratify the sample. The default is None, which stratifies by number
+        of stops only.
     **kwargs :
         Inputs placed in output. Intended for testing_time_seconds and
         training_time_seconds
@@ -130,42 +349,750 @@ def evaluate(actual_routes_json,submission_json,cost_matrices_json, invalid_scor
         of routes, and kwargs.
 
     '''
+    with profiling(Profile(profile) if profile>0 else None) as active:
+        scores=_evaluate(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json,
+            workers,cache_dir,validate,route_cache_json,gap_penalties=gap_penalties,
+            sample=sample,sample_seed=sample_seed,route_data_json=route_data_json,**kwargs)
+    if active is not None:
+        scores['profile']=active.report()
+    return scores
+
+def _evaluate(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json,
+        workers,cache_dir,validate,route_cache_json,sample,sample_seed,route_data_json,**kwargs):
+    ground_truth=load_ground_truth(actual_routes_json,cost_matrices_json,invalid_scores_json,
+        keep_matrices=workers>1,validate=validate,cache_dir=cache_dir)
+    submission=load_submission(submission_json)
+    if sample is not None:
+        import sampling
+        actual_routes=ground_truth['actual_routes']
+        station_codes=None
+        if route_data_json is not None:
+            station_codes=sampling.load_station_codes(route_data_json,actual_routes)
+        strata=sampling.stratify(actual_routes,station_codes)
+        drawn=sampling.draw_sample(strata,sample,sample_seed)
+        sampled_routes=set().union(*drawn.values())
+        kwargs['routes']=[route for route in actual_routes if route in sampled_routes]
+    if route_cache_json is None:
+        scores=score_submission(submission,ground_truth,workers=workers,**kwargs)
+    else:
+        import input_cache
+        ground_truth_hash=input_cache.source_hash(actual_routes_json,cost_matrices_json,invalid_scores_json)
+        route_cache=load_route_cache(route_cache_json,ground_truth_hash)
+        scores=score_submission(submission,ground_truth,workers=workers,route_cache=route_cache,**kwargs)
+        save_route_cache(route_cache_json,route_cache)
+    if sample is not None:
+        scores['sample']=sampling.estimate(scores['route_scores'],strata,drawn,sample_seed)
+        scores['submission_score']=scores['sample']['submission_score']
+        if 'gap_sweep' in scores:
+            # Each gap penalty is estimated like the submission score
+            sweep=scores['gap_sweep']
+            estimates=[sampling.estimate({route:route_sweep[k] for route,route_sweep in sweep['route_scores'].items()},
+                strata,drawn,sample_seed) for k in range(len(sweep['gap_penalties']))]
+            sweep['submission_scores']=[estimate['submission_score'] for estimate in estimates]
+            sweep['confidence_intervals']=[estimate['confidence_interval'] for estimate in estimates]
+    return scores
+
+def evaluate_batch(actual_routes_json,submission_jsons,cost_matrices_json,invalid_scores_json,output_dir,workers=1,cache_dir=None,validate=True,**kwargs):
+    '''
+    Calculates scores for several submissions against the same actual routes,
+    loading and normalizing the other inputs once.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    submission_jsons : list
+        filepaths of JSONs of participant-created routes, or of directories
+        whose JSON files are all submissions.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    output_dir : str
+        Directory where a <submission-name>/scores.json file is written for
+        each submission, along with a summary.csv table.
+    workers : int, optional
+        Number of processes used to score routes. The default is 1.
+    cache_dir : str, optional
+        Directory of the binary input cache. The default is None.
+    validate : bool, optional
+        If False, the inputs other than the submissions are not checked with
+        good_format. The default is True.
+    **kwargs :
+        Inputs placed in every output.
+
+    Returns
+    -------
+    summary : list
+        One dictionary per submission, in the order they were scored, with
+        the rows of summary.csv.
+
+    '''
+    ground_truth=load_ground_truth(actual_routes_json,cost_matrices_json,invalid_scores_json,
+        validate=validate,cache_dir=cache_dir)
+    summary=[]
+    names=set()
+    for submission_json in list_submissions(submission_jsons):
+        name=os.path.splitext(os.path.basename(submission_json))[0]
+        # Disambiguate files with the same name in different directories
+        unique_name,suffix=name,1
+        while unique_name in names:
+            suffix+=1
+            unique_name='{}_{}'.format(name,suffix)
+        names.add(unique_name)
+        scores=score_submission(load_submission(submission_json),ground_truth,workers=workers,**kwargs)
+        scores_json=os.path.join(output_dir,unique_name,'scores.json')
+        os.makedirs(os.path.dirname(scores_json),exist_ok=True)
+        with open(scores_json,'w') as out_file:
+            json.dump(scores,out_file)
+        summary.append({
+            'submission':submission_json,
+            'submission_score':scores['submission_score'],
+            'feasible_routes':sum(scores['route_feasibility'].values()),
+            'routes':len(scores['route_feasibility']),
+            'scores_json':scores_json
+            })
+    os.makedirs(output_dir,exist_ok=True)
+    with open(os.path.join(output_dir,'summary.csv'),'w',newline='') as out_file:
+        writer=csv.DictWriter(out_file,fieldnames=['submission','submission_score','feasible_routes','routes','scores_json'])
+        writer.writeheader()
+        writer.writerows(summary)
+    return summary
+
+def list_submissions(paths):
+    '''
+    Expands directories of submission files.
+
+    Parameters
+    ----------
+    paths : list
+        filepaths of submission JSONs or of directories containing them.
+
+    Returns
+    -------
+    submission_jsons : list
+        filepaths of submission JSONs. Files of a directory are sorted by name.
+
+    '''
+    submission_jsons=[]
+    for path in paths:
+        if os.path.isdir(path):
+            submission_jsons.extend(sorted(os.path.join(path,name) for name in os.listdir(path)
+                if name.endswith('.json')))
+        else:
+            submission_jsons.append(path)
+    return submission_jsons
+
+def load_ground_truth(actual_routes_json,cost_matrices_json,invalid_scores_json,keep_matrices=True,validate=True,cache_dir=None):
+    '''
+    Loads and checks the inputs of evaluate that do not depend on the
+    submission, so they can be reused to score several submissions.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    keep_matrices : bool, optional
+        If False, cost matrices are streamed from their file while scoring and
+        dropped once used, and the ground truth can score a single
+        submission, serially. The default is True.
+    validate : bool, optional
+        If False, the inputs are not checked with good_format. Only use it for
+        inputs that have already passed validation. The default is True.
+    cache_dir : str, optional
+        If given, the inputs are loaded through a binary cache in this
+        directory (see input_cache.py), and keep_matrices and validate are
+        only used if the cache cannot be written. The default is None.
+
+    Returns
+    -------
+    ground_truth : dict
+        Actual routes, cost matrices (as CostMatrices) and invalid scores.
+
+    '''
+    if cache_dir is not None:
+        import input_cache
+        return input_cache.load_ground_truth(actual_routes_json,cost_matrices_json,
+            invalid_scores_json,cache_dir,keep_matrices,validate)
     actual_routes=read_json_data(actual_routes_json)
-    good_format(actual_routes,'actual',actual_routes_json)
+    if validate:
+        good_format(actual_routes,'actual',actual_routes_json)
+    cost_matrices=CostMatrices.from_json(cost_matrices_json,actual_routes,keep_matrices,validate)
+    invalid_scores=read_json_data(invalid_scores_json)
+    if validate:
+        good_format(invalid_scores,'invalids',invalid_scores_json)
+    return {
+        'actual_routes':actual_routes,
+        'cost_matrices':cost_matrices,
+        'invalid_scores':invalid_scores
+        }
+
+def load_submission(submission_json):
+    '''
+    Loads and checks a file of participant-created routes.
+
+    Parameters
+    ----------
+    submission_json : str
+        filepath of JSON of participant-created routes.
+
+    Returns
+    -------
+    submission : dict
+        Dictionary form of the submission.
+
+    '''
     submission=read_json_data(submission_json)
     good_format(submission,'proposed',submission_json)
-    cost_matrices=read_json_data(cost_matrices_json)
-    good_format(cost_matrices,'costs',cost_matrices_json)
-    invalid_scores=read_json_data(invalid_scores_json)
-    good_format(invalid_scores,'invalids',invalid_scores_json)
+    return submission
+
+def score_submission(submission,ground_truth,workers=1,route_cache=None,gap_penalties=None,routes=None,**kwargs):
+    '''
+    Calculates score for a loaded submission against loaded ground truth.
+
+    Parameters
+    ----------
+    submission : dict
+        Participant-created routes, as returned by load_submission.
+    ground_truth : dict
+        Ground truth, as returned by load_ground_truth.
+    workers : int, optional
+        Number of processes used to score routes. The default is 1, which
+        scores every route in the calling process.
+    route_cache : dict, optional
+        Results of a previous scoring, as returned by load_route_cache. Only
+        routes whose proposed sequence changed since are scored again, and
+        the cache is updated in place. The default is None.
+    gap_penalties : list, optional
+        ERP gap penalties to score the submission with, in addition to the
+        default one. The sequence deviation and the edit distances for every
+        penalty are computed once per route, with erp_per_edit_sweep. The
+        default is None.
+    routes : list, optional
+        Routes to score, in the order of the output. The default is None,
+        which scores every actual route.
+    **kwargs :
+        Inputs placed in output.
+
+    Raises
+    ------
+    ValueError
+        Both route_cache and gap_penalties are given.
+
+    Returns
+    -------
+    scores : dict
+        Dictionary containing submission score, individual route scores, feasibility
+        of routes, and kwargs. With gap_penalties, 'gap_sweep' holds the
+        penalties and, in the same order, the submission scores and the scores
+        of each route.
+
+    '''
+    if route_cache is not None and gap_penalties is not None:
+        raise ValueError('Incremental scoring does not support gap penalty sweeps')
+    actual_routes=ground_truth['actual_routes']
     scores={'submission_score':'x','route_scores':{},'route_feasibility':{}}
     for kwarg in kwargs:
         scores[kwarg]=kwargs[kwarg]
-    for route in actual_routes:
-        if route not in submission:
-            scores['route_scores'][route]=invalid_scores[route]
-            scores['route_feasibility'][route]=False
-        else:
-            actual_dict=actual_routes[route]
-            actual=route2list(actual_dict)
-            try:
-                sub_dict=submission[route]
-                sub=route2list(sub_dict)
-            except:
-                scores['route_scores'][route]=invalid_scores[route]
-                scores['route_feasibility'][route]=False
-            else:
-                if isinvalid(actual,sub):
-                    scores['route_scores'][route]=invalid_scores[route]
-                    scores['route_feasibility'][route]=False
-                else:
-                     cost_mat=cost_matrices[route]
-                     scores['route_scores'][route]=score(actual,sub,cost_mat)
-                     scores['route_feasibility'][route]=True
+    requested=list(actual_routes) if routes is None else list(routes)
+    routes=requested
+    if route_cache is not None:
+        cached_routes=route_cache['routes']
+        proposals={route:proposal_hash(submission.get(route)) for route in routes}
+        results={route:(cached_routes[route]['score'],cached_routes[route]['feasible'])
+            for route in routes
+            if route in cached_routes and cached_routes[route]['proposal']==proposals[route]}
+        routes=[route for route in routes if route not in results]
+    else:
+        results={}
+    if ground_truth['cost_matrices'].stream is not None:
+        # Streamed matrices of routes that are cached, or whose proposal is
+        # missing or invalid, are dropped as they are parsed
+        ground_truth['cost_matrices'].restrict([route for route in routes
+            if proposal_positions(route,submission,ground_truth) is not None])
+    if workers>1:
+        if routes:
+            results.update(score_routes_parallel(routes,submission,ground_truth,workers,gap_penalties))
+    else:
+        results.update(score_routes(routes,submission,ground_truth,gap_penalties))
+        ground_truth['cost_matrices'].finish()
+    if route_cache is not None:
+        for route in routes:
+            route_cache['routes'][route]={
+                'proposal':proposals[route],
+                'score':results[route][0],
+                'feasible':results[route][1]
+                }
+        route_cache['rescored']=len(routes)
+    for route in requested:
+        scores['route_scores'][route],scores['route_feasibility'][route]=results[route][:2]
     submission_score=np.mean(list(scores['route_scores'].values()))
     scores['submission_score']=submission_score
+    if gap_penalties is not None:
+        route_sweeps={route:results[route][2] for route in requested}
+        scores['gap_sweep']={
+            'gap_penalties':list(gap_penalties),
+            'submission_scores':[np.mean([sweep[k] for sweep in route_sweeps.values()])
+                for k in range(len(gap_penalties))],
+            'route_scores':route_sweeps
+            }
     return scores
 
+def proposal_hash(route_dict):
+    '''
+    Hashes the proposed sequence of a route.
+
+    Parameters
+    ----------
+    route_dict : dict/None
+        Route of a submission, or None if the submission does not have it.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest, independent of the order of the stops.
+
+    '''
+    encoded=json.dumps(route_dict,sort_keys=True,separators=(',',':')).encode()
+    return hashlib.blake2b(encoded,digest_size=16).hexdigest()
+
+def load_route_cache(filepath,ground_truth_hash):
+    '''
+    Loads per-route results of previous scorings.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the route cache JSON. It does not need to exist.
+    ground_truth_hash : str
+        Hash of the inputs other than the submission, such as
+        input_cache.source_hash of their files. Results computed against
+        different inputs are discarded.
+
+    Returns
+    -------
+    route_cache : dict
+        Route cache to pass to score_submission.
+
+    '''
+    route_cache={'version':ROUTE_CACHE_VERSION,'ground_truth':ground_truth_hash,'routes':{}}
+    try:
+        with open(filepath, newline = '') as in_file:
+            previous=json.load(in_file)
+    except (OSError,ValueError):
+        return route_cache
+    if (type(previous)==dict and previous.get('version')==ROUTE_CACHE_VERSION
+            and previous.get('ground_truth')==ground_truth_hash
+            and type(previous.get('routes'))==dict):
+        route_cache['routes']=previous['routes']
+    return route_cache
+
+def save_route_cache(filepath,route_cache):
+    '''
+    Writes a route cache updated by score_submission. The file is replaced
+    atomically, so an interrupted write keeps the previous cache.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the route cache JSON.
+    route_cache : dict
+        Route cache, as returned by load_route_cache.
+
+    Returns
+    -------
+    None.
+
+    '''
+    tmp_path='{}.tmp'.format(filepath)
+    with open(tmp_path,'w') as out_file:
+        json.dump({key:route_cache[key] for key in ('version','ground_truth','routes')},out_file)
+    os.replace(tmp_path,filepath)
+
+def score_route(route,submission,ground_truth,gap_penalties=None):
+    '''
+    Scores one route of a submission, falling back to its invalid score.
+
+    Parameters
+    ----------
+    route : str
+        Route ID.
+    submission : dict
+        Participant-created routes.
+    ground_truth : dict
+        Ground truth, as returned by load_ground_truth.
+    gap_penalties : list, optional
+        If given, the scores of the route for these ERP gap penalties are
+        also returned. The default is None.
+
+    Returns
+    -------
+    route_score : float
+        Score of the route.
+    feasible : bool
+        False if the invalid score was used.
+    gap_scores : list
+        Score of the route for each gap penalty, only returned with
+        gap_penalties.
+
+    '''
+    invalid_score=ground_truth['invalid_scores'][route]
+    invalid=(invalid_score,False) if gap_penalties is None else (invalid_score,False,[invalid_score]*len(gap_penalties))
+    proposal=proposal_positions(route,submission,ground_truth)
+    if proposal is None:
+        return invalid
+    actual,sub_pos=proposal
+    stop_index,norm_mat=ground_truth['cost_matrices'].normalized(route)
+    actual_idx=[stop_index[stop] for stop in actual]
+    if gap_penalties is None:
+        return score_indexed(actual_idx,sub_pos,norm_mat),True
+    # The default gap penalty is computed in the same pass
+    route_scores=score_sweep(actual_idx,sub_pos,norm_mat,list(gap_penalties)+[1000])
+    return route_scores[-1],True,route_scores[:-1]
+
+def proposal_positions(route,submission,ground_truth):
+    '''
+    Finds the positions of the stops of a proposed route in its actual route.
+
+    Parameters
+    ----------
+    route : str
+        Route ID.
+    submission : dict
+        Participant-created routes.
+    ground_truth : dict
+        Ground truth, as returned by load_ground_truth.
+
+    Returns
+    -------
+    proposal : tuple/None
+        Actual route and position of each proposed stop in it, or None if the
+        proposal is missing or invalid, in which case the route gets its
+        invalid score.
+
+    '''
+    if route not in submission:
+        return None
+    actual=route2list(ground_truth['actual_routes'][route])
+    positions=route_positions(actual)
+    try:
+        sub_pos=route2positions(submission[route],positions)
+    except:
+        return None
+    if isinvalid_positions(sub_pos,len(actual)):
+        return None
+    return actual,sub_pos
+
+def score_routes(routes,submission,ground_truth,gap_penalties=None):
+    '''
+    Scores routes in the calling process with score_route, recording the
+    time spent on each route in the active profile.
+
+    Parameters
+    ----------
+    routes : list
+        Route IDs to score.
+    submission : dict
+        Participant-created routes.
+    ground_truth : dict
+        Ground truth, as returned by load_ground_truth.
+    gap_penalties : list, optional
+        ERP gap penalties passed to score_route. The default is None.
+
+    Returns
+    -------
+    results : dict
+        Route ID to (route_score, feasible), as returned by score_route.
+
+    '''
+    profile=_profiling.current()
+    if profile is None:
+        return {route:score_route(route,submission,ground_truth,gap_penalties) for route in routes}
+    results={}
+    actual_routes=ground_truth['actual_routes']
+    for route in routes:
+        start=time.perf_counter()
+        results[route]=score_route(route,submission,ground_truth,gap_penalties)
+        profile.add_route(route,len(actual_routes[route]['actual']),time.perf_counter()-start)
+    return results
+
+def score_routes_parallel(routes,submission,ground_truth,workers,gap_penalties=None):
+    '''
+    Scores routes in a pool of processes.
+
+    Routes are grouped into chunks of similar total size, estimated as the
+    square of the number of stops, and the largest chunks are submitted
+    first. The submission and ground truth are handed to each process once,
+    when it starts.
+
+    Parameters
+    ----------
+    routes : list
+        Route IDs to score.
+    submission : dict
+        Participant-created routes.
+    ground_truth : dict
+        Ground truth, as returned by load_ground_truth.
+    workers : int
+        Number of processes.
+    gap_penalties : list, optional
+        ERP gap penalties passed to score_route. The default is None.
+
+    Returns
+    -------
+    results : dict
+        Route ID to (route_score, feasible), as returned by score_route.
+
+    '''
+    actual_routes=ground_truth['actual_routes']
+    sizes={route:len(actual_routes[route]['actual'])**2 for route in routes}
+    # Longest-processing-time-first assignment to a few chunks per worker
+    num_chunks=min(len(routes),workers*4)
+    chunks=[[] for _ in range(num_chunks)]
+    loads=[0]*num_chunks
+    for route in sorted(routes,key=sizes.get,reverse=True):
+        lightest=loads.index(min(loads))
+        chunks[lightest].append(route)
+        loads[lightest]+=sizes[route]
+    order=sorted(range(num_chunks),key=loads.__getitem__,reverse=True)
+    if 'fork' in mp.get_all_start_methods():
+        context=mp.get_context('fork')
+    else:
+        context=mp.get_context()
+    profile=_profiling.current()
+    slowest=None if profile is None else profile.slowest
+    results={}
+    with ProcessPoolExecutor(max_workers=workers,mp_context=context,
+            initializer=_init_worker,initargs=(submission,ground_truth,gap_penalties,slowest)) as pool:
+        for chunk_results,chunk_profile in pool.map(_score_chunk,[chunks[i] for i in order]):
+            results.update(chunk_results)
+            if profile is not None:
+                profile.merge(chunk_profile)
+    return results
+
+_worker_inputs={}
+
+def _init_worker(submission,ground_truth,gap_penalties,slowest):
+    _worker_inputs['submission']=submission
+    _worker_inputs['ground_truth']=ground_truth
+    _worker_inputs['gap_penalties']=gap_penalties
+    _worker_inputs['slowest']=slowest
+
+def _score_chunk(routes):
+    submission=_worker_inputs['submission']
+    ground_truth=_worker_inputs['ground_truth']
+    gap_penalties=_worker_inputs['gap_penalties']
+    slowest=_worker_inputs['slowest']
+    if slowest is None:
+        return score_routes(routes,submission,ground_truth,gap_penalties),None
+    # Phases of worker processes are summed into the profile of the parent
+    with profiling(Profile(slowest)) as profile:
+        results=score_routes(routes,submission,ground_truth,gap_penalties)
+    return results,profile.dump()
+
+class CostMatrices:
+    '''
+    Per-route normalized view of cost matrices.
+
+    Each route's matrix is converted to a dense array and normalized the
+    first time it is requested, then cached. Loaded dictionaries are never
+    modified or copied.
+
+    Parameters
+    ----------
+    matrices : dict, optional
+        Cost matrices, as loaded from a travel times file. The default is
+        None, for matrices added with add or streamed with from_json.
+
+    '''
+    def __init__(self,matrices=None):
+        self.matrices=matrices if matrices is not None else {}
+        self.cache={}
+        self.stream=None
+        self.order=None
+
+    @classmethod
+    def from_json(cls,filepath,routes,keep=True,validate=True):
+        '''
+        Reads cost matrices from a travel times file one route at a time,
+        without building the nested dictionaries of the whole file.
+
+        Parameters
+        ----------
+        filepath : str
+            filepath of JSON of estimated times to travel between stops of
+            routes.
+        routes : dict/list
+            Routes to read, in the order they will be requested. Other routes
+            in the file are skipped.
+        keep : bool, optional
+            If True, every matrix is read and kept. If False, the file is
+            read lazily as routes are requested, and each matrix is dropped
+            once it has been returned. The default is True.
+        validate : bool, optional
+            If True, each matrix is checked as it is parsed. The default is
+            True.
+
+        Returns
+        -------
+        cost_matrices : CostMatrices
+
+        '''
+        cost_matrices=cls()
+        items=iter_cost_matrices(filepath,routes,validate)
+        if keep:
+            for route,stop_index,times in items:
+                cost_matrices.add(route,stop_index,times)
+        else:
+            cost_matrices.stream=items
+            cost_matrices.order={route:i for i,route in enumerate(routes)}
+        return cost_matrices
+
+    def add(self,route,stop_index,times):
+        '''
+        Normalizes and caches the dense matrix of a route.
+
+        Parameters
+        ----------
+        route : str
+            Route ID.
+        stop_index : dict
+            Stop ID to row/column index of times.
+        times : numpy.ndarray
+            Dense cost matrix, as returned by matrix_to_array.
+
+        Returns
+        -------
+        None.
+
+        '''
+        with profiled('normalize'):
+            norm_mat=normalize_array(times)
+        norm_mat.flags.writeable=False
+        self.cache[route]=(stop_index,norm_mat)
+
+    def normalized(self,route):
+        '''
+        Returns the stop index and normalized dense matrix of a route.
+
+        Parameters
+        ----------
+        route : str
+            Route ID.
+
+        Returns
+        -------
+        stop_index : dict
+            Stop ID to row/column index of norm_mat.
+        norm_mat : numpy.ndarray
+            Normalized cost matrix. It is shared between calls and must not be
+            modified.
+
+        '''
+        if self.stream is not None:
+            return self._next_streamed(route)
+        if route not in self.cache:
+            self.add(route,*matrix_to_array(self.matrices[route]))
+        return self.cache[route]
+
+    def finish(self):
+        '''
+        Reads the rest of a streamed file, so that format errors in routes
+        that were never requested are still reported, and drops the matrices
+        read ahead for routes that were not requested after all. Does nothing
+        if the matrices are not streamed.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.stream is not None:
+            for _ in self.stream:
+                pass
+            self.cache.clear()
+
+    def restrict(self,routes):
+        '''
+        Limits the routes that will be requested from streamed matrices, so
+        that other matrices are skipped rather than normalized and kept. Does
+        nothing if the matrices are not streamed.
+
+        Parameters
+        ----------
+        routes : list
+            Routes that will be requested, in order.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.stream is not None:
+            self.order={route:i for i,route in enumerate(routes)}
+
+    def _next_streamed(self,route):
+        if route in self.cache:
+            return self.cache.pop(route)
+        position=self.order[route]
+        for name,stop_index,times in self.stream:
+            if name==route:
+                self.add(name,stop_index,times)
+                return self.cache.pop(name)
+            # Keep only routes that can still be requested
+            if self.order.get(name,-1)>position:
+                self.add(name,stop_index,times)
+        raise KeyError(route)
+
+def iter_cost_matrices(filepath,routes=None,validate=True):
+    '''
+    Streams the cost matrices of a travel times file as dense arrays.
+
+    Parameters
+    ----------
+    filepath : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    routes : container, optional
+        If given, only these routes are read. The default is None.
+    validate : bool, optional
+        If True, each matrix is checked as it is parsed, and a
+        JSONDecodeError listing every violation is raised once the whole file
+        has been read. The default is True.
+
+    Yields
+    ------
+    route : str
+        Route ID.
+    stop_index : dict
+        Stop ID to row/column index of times.
+    times : numpy.ndarray
+        Dense cost matrix, as returned by matrix_to_array.
+
+    '''
+    errors=[]
+    items=read_json_items(filepath,routes)
+    while True:
+        with profiled('load'):
+            item=next(items,None)
+        if item is None:
+            break
+        route,mat=item
+        if validate:
+            with profiled('validate'):
+                route_errors=format_errors({route:mat},'costs',filepath)
+            if route_errors:
+                errors.extend(route_errors)
+                continue
+        with profiled('load'):
+            stop_index,times=matrix_to_array(mat)
+        yield route,stop_index,times
+    if errors:
+        raise JSONDecodeError('\n'.join(errors))
+
 def score(actual,sub,cost_mat,g=1000):
     '''
     Scores individual routes.
@@ -188,8 +1115,97 @@ def score(actual,sub,cost_mat,g=1000):
         Accuracy score from comparing sub to actual.
 
     '''
-    norm_mat=normalize_matrix(cost_mat)
-    return seq_dev(actual,sub)*erp_per_edit(actual,sub,norm_mat,g)
+    stop_index,times=matrix_to_array(cost_mat)
+    return score_normalized(actual,sub,stop_index,normalize_array(times),g)
+
+def score_normalized(actual,sub,stop_index,norm_mat,g=1000):
+    '''
+    Scores individual routes against an already normalized dense matrix.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route.
+    sub : list
+        Submitted route.
+    stop_index : dict
+        Stop ID to row/column index of norm_mat.
+    norm_mat : numpy.ndarray
+        Normalized cost matrix, as returned by normalize_array.
+    g : int/float, optional
+        ERP gap penalty. The default is 1000.
+
+    Returns
+    -------
+    float
+        Accuracy score from comparing sub to actual.
+
+    '''
+    positions=route_positions(actual)
+    actual_idx=[stop_index[stop] for stop in actual]
+    sub_pos=[positions[stop] for stop in sub]
+    return score_indexed(actual_idx,sub_pos,norm_mat,g)
+
+def score_indexed(actual_idx,sub_pos,norm_mat,g=1000):
+    '''
+    Scores individual routes given as indices.
+
+    Parameters
+    ----------
+    actual_idx : list
+        Actual route as row/column indices of norm_mat.
+    sub_pos : list
+        Submitted route as positions of its stops in the actual route, as
+        returned by route2positions.
+    norm_mat : numpy.ndarray
+        Normalized cost matrix, as returned by normalize_array.
+    g : int/float, optional
+        ERP gap penalty. The default is 1000.
+
+    Returns
+    -------
+    float
+        Accuracy score from comparing sub to actual.
+
+    '''
+    sub_idx=[actual_idx[position] for position in sub_pos]
+    with profiled('seq_dev'):
+        deviation=seq_dev_positions(sub_pos)
+    with profiled('erp'):
+        erp=erp_per_edit_indexed(actual_idx,sub_idx,norm_mat,g)
+    return deviation*erp
+
+def score_sweep(actual_idx,sub_pos,norm_mat,gs):
+    '''
+    Scores individual routes given as indices for several gap penalties,
+    sharing the sequence deviation and a single ERP pass.
+
+    Parameters
+    ----------
+    actual_idx : list
+        Actual route as row/column indices of norm_mat.
+    sub_pos : list
+        Submitted route as positions of its stops in the actual route, as
+        returned by route2positions.
+    norm_mat : numpy.ndarray
+        Normalized cost matrix, as returned by normalize_array.
+    gs : list
+        ERP gap penalties.
+
+    Returns
+    -------
+    list
+        Accuracy score from comparing sub to actual for each gap penalty,
+        equal to score_indexed with that penalty.
+
+    '''
+    sub_idx=[actual_idx[position] for position in sub_pos]
+    with profiled('seq_dev'):
+        deviation=seq_dev_positions(sub_pos)
+    with profiled('erp'):
+        totals,counts=erp_per_edit_sweep(actual_idx,sub_idx,norm_mat,gs)
+    return [deviation*(0 if count==0 else total/count)
+        for total,count in zip(totals.tolist(),counts.tolist())]
 
 def erp_per_edit(actual,sub,matrix,g=1000):
     '''
@@ -213,7 +1229,33 @@ def erp_per_edit(actual,sub,matrix,g=1000):
         ERP divided by number of ERP edits or 0 if there are 0 edits.
 
     '''
-    total,count=erp_per_edit_helper(actual,sub,matrix,g)
+    stop_index,dense=matrix_to_array(matrix)
+    actual_idx=[stop_index[stop] for stop in actual]
+    sub_idx=[stop_index[stop] for stop in sub]
+    return erp_per_edit_indexed(actual_idx,sub_idx,dense,g)
+
+def erp_per_edit_indexed(actual,sub,matrix,g=1000):
+    '''
+    Same as erp_per_edit, for routes given as integer stop indices.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route as stop indices.
+    sub : list
+        Submitted route as stop indices.
+    matrix : numpy.ndarray
+        Normalized dense cost matrix, as returned by normalize_array.
+    g : int/float, optional
+        ERP gap penalty. The default is 1000.
+
+    Returns
+    -------
+    int/float
+        ERP divided by number of ERP edits or 0 if there are 0 edits.
+
+    '''
+    total,count=erp_per_edit_banded(actual,sub,matrix,g)
     if count==0:
         return 0
     else:
@@ -281,6 +1323,252 @@ def erp_per_edit_helper(actual,sub,matrix,g=1000,memo=None):
     memo[(actual_tuple,sub_tuple)]=(d,count)
     return d,count
 
+def erp_per_edit_banded(actual,sub,matrix,g=1000,width=0):
+    '''
+    Calculates ERP and counts number of edits in the process, exactly, by
+    only filling the states near the diagonal.
+
+    State (i,j) is in the band if its offset i-j is at most width away from
+    the offsets of the first and last states. Every path from the first state
+    to the last that leaves the band takes some minimum number of gaps, so if
+    the banded ERP is smaller than that many gap penalties, no such path can
+    be optimal. The same options are then picked along the optimal path as
+    with a band covering every state, with the same tie-breaking as
+    erp_per_edit_helper, and both the distance and the count are identical.
+    Otherwise the band is widened until the result is proven or the band
+    covers every state.
+
+    Identical sequences and sequences that only differ by local swaps, in
+    particular in long identical prefixes and suffixes, are proven with a
+    narrow band, in about linear time.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route as integer stop indices.
+    sub : list
+        Submitted route as integer stop indices.
+    matrix : list/array
+        Normalized cost matrix indexable as matrix[origin][destination] by
+        the same stop indices. Costs must be non-negative.
+    g : int/float, optional
+        Gap penalty. The default is 1000.
+    width : int, optional
+        Initial width of the band. The default is 0.
+
+    Returns
+    -------
+    d : float
+        ERP from comparing sub to actual.
+    count : int
+        Number of edits in ERP.
+
+    '''
+    n=len(actual)
+    m=len(sub)
+    rows={}
+    while True:
+        low=min(0,n-m)-width
+        high=max(0,n-m)+width
+        if kernels.AVAILABLE and isinstance(matrix,np.ndarray):
+            d,count=kernels.erp_band(actual,sub,matrix,g,low,high)
+        else:
+            d,count=erp_band(actual,sub,matrix,g,low,high,rows)
+        if low<=-m and high>=n:
+            # The band covers every state
+            return d,count
+        # Fewest gaps of a path reaching offset low-1 or high+1
+        gaps=min(2*(high+1)-(n-m) if high<n else n+m+1,
+            (n-m)-2*(low-1) if low>-m else n+m+1)
+        bound=0
+        for _ in range(gaps):
+            bound+=g
+        if d<bound:
+            return d,count
+        width=2*width+1
+
+def erp_band(actual,sub,matrix,g,low,high,rows=None):
+    '''
+    Fills the states (i,j) with low <= i-j <= high of the bottom-up
+    equivalent of erp_per_edit_helper, considering states outside of the
+    band unreachable.
+
+    State (i,j) compares actual[i:] to sub[j:], so rows are filled from the
+    end of both sequences and ties between options are broken in the same
+    order as the recursion. Only two rows of distances and edit counts are
+    kept at a time. With low <= -len(sub) and high >= len(actual), every
+    state is filled.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route as integer stop indices.
+    sub : list
+        Submitted route as integer stop indices.
+    matrix : list/array
+        Normalized cost matrix.
+    g : int/float
+        Gap penalty.
+    low : int
+        Smallest offset i-j in the band.
+    high : int
+        Largest offset i-j in the band.
+    rows : dict, optional
+        Cache of the rows of matrix converted to lists, shared between
+        calls. The default is None.
+
+    Returns
+    -------
+    d : float
+        ERP from comparing sub to actual within the band, which is infinite
+        if the band does not connect the first and last states.
+    count : int
+        Number of edits in that ERP.
+
+    '''
+    if rows is None:
+        rows={}
+    inf=float('inf')
+    n=len(actual)
+    m=len(sub)
+    # Gap sums are accumulated one gap at a time, like gap_sum
+    gap_col=[0]*(n+1)
+    for i in range(n-1,-1,-1):
+        gap_col[i]=gap_col[i+1]+g
+    next_d=[0]*(m+1)
+    for j in range(m-1,-1,-1):
+        next_d[j]=next_d[j+1]+g
+    next_c=list(range(m,-1,-1))
+    for j in range(m+1):
+        if not low<=n-j<=high:
+            next_d[j]=inf
+    for i in range(n-1,-1,-1):
+        head_actual=actual[i]
+        costs=rows.get(head_actual)
+        if costs is None:
+            costs=matrix[head_actual]
+            if isinstance(costs,np.ndarray):
+                # Python floats are much cheaper to index and add than NumPy scalars
+                costs=costs.tolist()
+            rows[head_actual]=costs
+        cur_d=[inf]*(m+1)
+        cur_c=[0]*(m+1)
+        if low<=i-m<=high:
+            cur_d[m]=gap_col[i]
+            cur_c[m]=n-i
+        for j in range(min(m-1,i-low),max(0,i-high)-1,-1):
+            head_sub=sub[j]
+            option_1=next_d[j+1]+costs[head_sub]
+            option_2=next_d[j]+g
+            option_3=cur_d[j+1]+g
+            d=min(option_1,option_2,option_3)
+            if d==option_1:
+                if head_actual==head_sub:
+                    count=next_c[j+1]
+                else:
+                    count=next_c[j+1]+1
+            elif d==option_2:
+                count=next_c[j]+1
+            else:
+                count=cur_c[j+1]+1
+            cur_d[j]=d
+            cur_c[j]=count
+        next_d=cur_d
+        next_c=cur_c
+    return next_d[0],next_c[0]
+
+def erp_per_edit_sweep(actual,sub,matrix,gs):
+    '''
+    Calculates ERP and counts number of edits for several gap penalties at
+    once.
+
+    Same recurrence and tie-breaking as erp_band, but the states are filled
+    one anti-diagonal at a time, since the states of an anti-diagonal only
+    depend on the two following ones, and every gap penalty is computed in
+    the same array operations. Only three anti-diagonals are kept, so memory
+    grows with min(len(actual),len(sub)) times the number of gap penalties.
+    Each result equals erp_per_edit_banded for its gap penalty.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route as integer stop indices.
+    sub : list
+        Submitted route as integer stop indices.
+    matrix : numpy.ndarray
+        Normalized dense cost matrix, as returned by normalize_array.
+    gs : list
+        Gap penalties.
+
+    Returns
+    -------
+    d : numpy.ndarray
+        ERP from comparing sub to actual, for each gap penalty.
+    count : numpy.ndarray
+        Number of edits in ERP, for each gap penalty.
+
+    '''
+    n=len(actual)
+    m=len(sub)
+    g=np.asarray(gs,dtype=float)
+    k=len(g)
+    actual=np.asarray(actual,dtype=np.intp)
+    sub=np.asarray(sub,dtype=np.intp)
+    matrix=np.asarray(matrix)
+    # State (i,j) compares actual[i:] to sub[j:]. Anti-diagonal i+j=t is kept
+    # in the buffers t%3, at index i-max(0,t-m), so memory does not grow with
+    # n*m
+    size=min(n,m)+1
+    d=[np.empty((size,k)) for _ in range(3)]
+    count=[np.empty((size,k),dtype=np.int64) for _ in range(3)]
+    d[(n+m)%3][0]=0
+    count[(n+m)%3][0]=0
+    for diagonal in range(n+m-1,-1,-1):
+        cur_d,cur_c=d[diagonal%3],count[diagonal%3]
+        next_d,next_c=d[(diagonal+1)%3],count[(diagonal+1)%3]
+        after_d,after_c=d[(diagonal+2)%3],count[(diagonal+2)%3]
+        low=max(0,diagonal-m)
+        next_low=max(0,diagonal+1-m)
+        after_low=max(0,diagonal+2-m)
+        # Gap sums are accumulated one gap at a time, like gap_sum
+        if diagonal>=n:
+            cur_d[n-low]=next_d[n-next_low]+g
+            cur_c[n-low]=next_c[n-next_low]+1
+        if diagonal>=m:
+            cur_d[diagonal-m-low]=next_d[diagonal-m+1-next_low]+g
+            cur_c[diagonal-m-low]=next_c[diagonal-m+1-next_low]+1
+        i=np.arange(max(0,diagonal-m+1),min(n-1,diagonal)+1)
+        if len(i)==0:
+            continue
+        j=diagonal-i
+        option_1=after_d[i+1-after_low]+matrix[actual[i],sub[j]][:,None]
+        option_2=next_d[i+1-next_low]+g
+        option_3=next_d[i-next_low]+g
+        # Same comparisons as min, which keeps the first of equal or NaN options
+        best=np.where(option_2<option_1,option_2,option_1)
+        best=np.where(option_3<best,option_3,best)
+        cur_d[i-low]=best
+        cur_c[i-low]=np.where(best==option_1,after_c[i+1-after_low]+(actual[i]!=sub[j])[:,None],
+            np.where(best==option_2,next_c[i+1-next_low],next_c[i-next_low])+1)
+    return d[0][0],count[0][0]
+
+def index_stops(matrix):
+    '''
+    Maps each stop of a cost matrix to an integer index.
+
+    Parameters
+    ----------
+    matrix : dict
+        Cost matrix.
+
+    Returns
+    -------
+    stop_index : dict
+        Stop ID to integer index, in the order of the matrix origins.
+
+    '''
+    return {stop:i for i,stop in enumerate(matrix)}
+
 def normalize_matrix(mat):
     '''
     Normalizes cost matrix.
@@ -296,7 +1584,7 @@ def normalize_matrix(mat):
         Normalized cost matrix.
 
     '''
-    new_mat=mat.copy()
+    new_mat={origin:{} for origin in mat}
     time_list=[]
     for origin in mat:
         for destination in mat[origin]:
@@ -318,6 +1606,59 @@ def normalize_matrix(mat):
             new_mat[origin][destination]=shifted_time
     return new_mat
 
+def matrix_to_array(mat):
+    '''
+    Converts a cost matrix to a stop index and a dense array.
+
+    Parameters
+    ----------
+    mat : dict
+        Cost matrix.
+
+    Returns
+    -------
+    stop_index : dict
+        Stop ID to row/column index of times.
+    times : numpy.ndarray
+        Square float64 array of travel times. Pairs missing from mat are NaN.
+
+    '''
+    stop_index=index_stops(mat)
+    stops=list(stop_index)
+    n=len(stops)
+    times=np.full((n,n),np.nan)
+    for origin,dests in mat.items():
+        row=times[stop_index[origin]]
+        if len(dests)==n and list(dests)==stops:
+            row[:]=np.fromiter(dests.values(),dtype=float,count=n)
+        else:
+            for dest,time in dests.items():
+                row[stop_index[dest]]=time
+    return stop_index,times
+
+def normalize_array(times):
+    '''
+    Normalizes a dense cost matrix. Vectorized equivalent of normalize_matrix.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        Dense cost matrix, as returned by matrix_to_array.
+
+    Returns
+    -------
+    new_times : numpy.ndarray
+        Normalized cost matrix. Missing pairs stay NaN.
+
+    '''
+    missing=np.isnan(times)
+    values=times[~missing] if missing.any() else times
+    avg_time=np.mean(values)
+    std_time=np.std(values)
+    new_times=(times-avg_time)/std_time
+    new_times-=np.nanmin(new_times)
+    return new_times
+
 def gap_sum(path,g):
     '''
     Calculates ERP between two sequences when at least one is empty.
@@ -384,15 +1725,32 @@ def seq_dev(actual,sub):
         Sequence deviation.
 
     '''
-    actual=actual[1:-1]
-    sub=sub[1:-1]
-    comp_list=[]
-    for i in sub:
-        comp_list.append(actual.index(i))
-        comp_sum=0
-    for ind in range(1,len(comp_list)):
-        comp_sum+=abs(comp_list[ind]-comp_list[ind-1])-1
-    n=len(actual)
+    positions=route_positions(actual)
+    return seq_dev_positions([positions[stop] for stop in sub])
+
+def seq_dev_positions(sub_pos):
+    '''
+    Calculates sequence deviation from the positions of the submitted stops
+    in the actual route, in O(n).
+
+    Parameters
+    ----------
+    sub_pos : list
+        Submitted route as positions of its stops in the actual route, with
+        the station at both ends, as returned by route2positions.
+
+    Returns
+    -------
+    float
+        Sequence deviation.
+
+    '''
+    if kernels.AVAILABLE:
+        comp_sum=kernels.seq_dev_sum(sub_pos[1:-1])
+    else:
+        comp_list=np.asarray(sub_pos[1:-1])
+        comp_sum=int(np.abs(np.diff(comp_list)).sum())-(len(comp_list)-1)
+    n=len(sub_pos)-2
     return (2/(n*(n-1)))*comp_sum
 
 def isinvalid(actual,sub):
@@ -443,3 +1801,78 @@ def route2list(route_dict):
         route_list[stops[stop]]=stop
     route_list[-1]=route_list[0]
     return route_list
+
+def route_positions(actual):
+    '''
+    Indexes the position of each stop in the actual route.
+
+    Parameters
+    ----------
+    actual : list
+        Actual route, as returned by route2list.
+
+    Returns
+    -------
+    positions : dict
+        Stop ID to its position in actual. The station is at position 0.
+
+    '''
+    return {stop:i for i,stop in enumerate(actual[:-1])}
+
+def route2positions(route_dict,positions):
+    '''
+    Translates route from dictionary to the positions of its stops in the
+    actual route. Equivalent to mapping the result of route2list through
+    positions, and raises the same errors for improper stop numbers.
+
+    Parameters
+    ----------
+    route_dict : dict
+        Route as a dictionary.
+    positions : dict
+        Stop ID to position in the actual route, as returned by
+        route_positions.
+
+    Returns
+    -------
+    route_pos : list
+        Route as a list of positions. Stops missing from the actual route and
+        positions that no stop was assigned to are -1.
+
+    '''
+    if 'proposed' in route_dict:
+        stops=route_dict['proposed']
+    elif 'actual' in route_dict:
+        stops=route_dict['actual']
+    route_pos=[-1]*(len(stops)+1)
+    for stop in stops:
+        route_pos[stops[stop]]=positions.get(stop,-1)
+    route_pos[-1]=route_pos[0]
+    return route_pos
+
+def isinvalid_positions(sub_pos,num_actual):
+    '''
+    Checks if submitted route is invalid. Equivalent to isinvalid for routes
+    given as positions in the actual route.
+
+    Parameters
+    ----------
+    sub_pos : list
+        Submitted route, as returned by route2positions.
+    num_actual : int
+        Length of the actual route, as returned by route2list.
+
+    Returns
+    -------
+    bool
+        True if route is invalid. False otherwise.
+
+    '''
+    # Every stop has one position, so the stops of both routes match exactly
+    # when every position is filled with a stop of the actual route
+    if len(sub_pos)!=num_actual or min(sub_pos)<0:
+        return True
+    elif sub_pos[0]!=0:
+        return True
+    else:
+        return False
@@ -0,0 +1,204 @@
+import json, os, socketserver, sys, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, parse_qsl
+# Import local score file
+import score
+
+# Query parameters of POST /score, placed in the output like the model times
+# of scores.json
+METADATA=('model_apply_time','model_build_time')
+
+class ScoringService:
+    '''
+    Keeps the ground truth of evaluate loaded, with every cost matrix
+    normalized, and scores submissions against it.
+
+    The input files are checked for changes before each scoring, and loaded
+    again if any of them changed.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    workers : int, optional
+        Number of processes used to score routes. The default is 1.
+    cache_dir : str, optional
+        Directory of the binary cache of the inputs, see evaluate. The
+        default is None.
+    validate : bool, optional
+        If False, the format of the inputs is not checked. The default is
+        True.
+
+    '''
+    def __init__(self,actual_routes_json,cost_matrices_json,invalid_scores_json,workers=1,cache_dir=None,validate=True):
+        self.sources=(actual_routes_json,cost_matrices_json,invalid_scores_json)
+        self.workers=workers
+        self.cache_dir=cache_dir
+        self.validate=validate
+        self.ground_truth=None
+        self.signature=None
+        self.load()
+
+    def load(self):
+        '''
+        Loads the ground truth if it is not loaded or its files changed.
+
+        Returns
+        -------
+        bool
+            True if the ground truth was loaded.
+
+        '''
+        signature=self.source_signature()
+        if self.ground_truth is not None and signature==self.signature:
+            return False
+        self.ground_truth=score.load_ground_truth(*self.sources,keep_matrices=True,
+            validate=self.validate,cache_dir=self.cache_dir)
+        self.signature=signature
+        return True
+
+    def source_signature(self):
+        signature=[]
+        for filepath in self.sources:
+            try:
+                stat=os.stat(filepath)
+                signature.append((stat.st_mtime_ns,stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return signature
+
+    def score(self,submission,**metadata):
+        '''
+        Scores a submission.
+
+        Parameters
+        ----------
+        submission : dict
+            Participant-created routes, in the format of a proposed sequences
+            file.
+        **metadata :
+            Values placed in output after scoring, such as model times.
+
+        Raises
+        ------
+        JSONDecodeError
+            The submission does not have the format of a proposed sequences
+            file.
+
+        Returns
+        -------
+        scores : dict
+            Same as evaluate.
+
+        '''
+        self.load()
+        score.good_format(submission,'proposed','the request')
+        scores=score.score_submission(submission,self.ground_truth,workers=self.workers)
+        scores.update(metadata)
+        return scores
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP interface of a ScoringService.
+
+    POST /score with a proposed sequences file as body returns the content of
+    scores.json. The query parameters in METADATA are placed in the output,
+    and any other one is rejected. GET /health returns the number of loaded
+    routes.
+    '''
+    def do_GET(self):
+        if urlsplit(self.path).path!='/health':
+            return self.send_json(404,{'error':'Not found'})
+        self.send_json(200,{'status':'ok','routes':len(self.server.service.ground_truth['actual_routes'])})
+
+    def do_POST(self):
+        url=urlsplit(self.path)
+        if url.path!='/score':
+            return self.send_json(404,{'error':'Not found'})
+        try:
+            body=self.rfile.read(int(self.headers.get('Content-Length',0)))
+            metadata={key:parse_value(value) for key,value in parse_qsl(url.query)}
+            unknown=sorted(set(metadata)-set(METADATA))
+            if unknown:
+                raise ValueError('Unknown query parameters: {} (expected {})'.format(
+                    ', '.join(unknown),', '.join(METADATA)))
+            submission=json.loads(body)
+            if type(submission)!=dict:
+                raise ValueError('The request body must be a JSON object of proposed sequences, not {}'.format(
+                    type(submission).__name__))
+            start=time.perf_counter()
+            scores=self.server.service.score(submission,**metadata)
+        except (ValueError,score.JSONDecodeError) as e:
+            # json.JSONDecodeError is a ValueError
+            return self.send_json(400,{'error':str(e)})
+        except Exception as e:
+            return self.send_json(500,{'error':'{}: {}'.format(type(e).__name__,e)})
+        self.log_message('scored %d routes in %.3f s',len(scores['route_scores']),time.perf_counter()-start)
+        self.send_json(200,scores)
+
+    def send_json(self,status,payload):
+        body=json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    def get_request(self):
+        request,_=super().get_request()
+        return request,''
+
+def serve(service,port=None,socket_path=None):
+    '''
+    Serves scoring requests until interrupted. Requests are handled one at a
+    time.
+
+    Parameters
+    ----------
+    service : ScoringService
+        Loaded scoring service.
+    port : int, optional
+        Port on localhost to listen on. Ignored if socket_path is given. The
+        default is None.
+    socket_path : str, optional
+        Path of a Unix socket to listen on. The default is None.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd=UnixHTTPServer(socket_path,ScoringRequestHandler)
+        address=socket_path
+    else:
+        httpd=HTTPServer(('127.0.0.1',port),ScoringRequestHandler)
+        address='http://127.0.0.1:{}'.format(httpd.server_port)
+    httpd.service=service
+    print('Scoring server listening on {}'.format(address))
+    sys.stdout.flush()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,239 @@
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+# Import local score files
+import input_cache
+import score
+
+class Shard:
+    '''
+    Set of the route IDs assigned to one of several shards.
+
+    Routes are assigned by a hash of their ID, so the assignment is the same
+    in every process and on every host.
+
+    Parameters
+    ----------
+    index : int
+        Shard number, from 0 to count-1.
+    count : int
+        Number of shards.
+
+    '''
+    def __init__(self,index,count):
+        if not 0<=index<count:
+            raise ValueError('Shard {} does not exist among {} shards'.format(index,count))
+        self.index=index
+        self.count=count
+
+    def __contains__(self,route):
+        digest=hashlib.blake2b(route.encode(),digest_size=8).digest()
+        return int.from_bytes(digest,'little')%self.count==self.index
+
+def shard_path(output_dir,index,count):
+    return os.path.join(output_dir,'shard-{:04d}-of-{:04d}.json'.format(index,count))
+
+def score_shard(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json,
+        output_dir,index,count,validate=True,inputs_hash=None):
+    '''
+    Scores the routes of one shard and writes them to a partial result file,
+    unless a complete file for the same inputs already exists.
+
+    Only the entries of the shard's routes are kept when the input files are
+    read, so memory is bounded by the size of the shard.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    submission_json : str
+        filepath of JSON of participant-created routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    output_dir : str
+        Directory of the partial result files.
+    index : int
+        Shard number, from 0 to count-1.
+    count : int
+        Number of shards.
+    validate : bool, optional
+        If False, the inputs other than the submission are not checked with
+        good_format. The default is True.
+    inputs_hash : str, optional
+        Hash of the four input files, as returned by input_cache.source_hash.
+        Computed if None. The default is None.
+
+    Returns
+    -------
+    path : str
+        filepath of the partial result file.
+    skipped : bool
+        True if the shard was already complete.
+
+    '''
+    if inputs_hash is None:
+        inputs_hash=input_cache.source_hash(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json)
+    path=shard_path(output_dir,index,count)
+    if read_shard(path,inputs_hash) is not None:
+        return path,True
+    shard=Shard(index,count)
+    actual_routes=dict(score.read_json_items(actual_routes_json,shard))
+    invalid_scores=dict(score.read_json_items(invalid_scores_json,shard))
+    if validate:
+        score.good_format(actual_routes,'actual',actual_routes_json)
+        score.good_format(invalid_scores,'invalids',invalid_scores_json)
+    submission=dict(score.read_json_items(submission_json,shard))
+    score.good_format(submission,'proposed',submission_json)
+    ground_truth={
+        'actual_routes':actual_routes,
+        'cost_matrices':score.CostMatrices.from_json(cost_matrices_json,actual_routes,keep=False,validate=validate),
+        'invalid_scores':invalid_scores
+        }
+    scores=score.score_submission(submission,ground_truth)
+    os.makedirs(output_dir,exist_ok=True)
+    # Write to a temporary file first, so a partial result file is complete
+    tmp_path='{}.{}.tmp'.format(path,os.getpid())
+    with open(tmp_path,'w') as out_file:
+        json.dump({
+            'inputs':inputs_hash,
+            'shard':index,
+            'shards':count,
+            'route_scores':scores['route_scores'],
+            'route_feasibility':scores['route_feasibility']
+            },out_file)
+    os.replace(tmp_path,path)
+    return path,False
+
+def read_shard(path,inputs_hash):
+    '''
+    Reads a partial result file, or returns None if it is missing, unreadable
+    or was computed from other inputs.
+    '''
+    try:
+        with open(path) as in_file:
+            partial=json.load(in_file)
+    except (OSError,ValueError):
+        return None
+    if type(partial)!=dict or partial.get('inputs')!=inputs_hash:
+        return None
+    return partial
+
+def merge_shards(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json,
+        output_dir,count,inputs_hash=None,**kwargs):
+    '''
+    Combines the partial result files of every shard into the output of
+    evaluate.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    submission_json : str
+        filepath of JSON of participant-created routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    output_dir : str
+        Directory of the partial result files.
+    count : int
+        Number of shards.
+    inputs_hash : str, optional
+        Hash of the four input files. Computed if None. The default is None.
+    **kwargs :
+        Inputs placed in output.
+
+    Raises
+    ------
+    FileNotFoundError
+        A shard has no complete result file for these inputs.
+
+    Returns
+    -------
+    scores : dict
+        Same as evaluate.
+
+    '''
+    if inputs_hash is None:
+        inputs_hash=input_cache.source_hash(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json)
+    route_scores={}
+    route_feasibility={}
+    missing=[]
+    for index in range(count):
+        partial=read_shard(shard_path(output_dir,index,count),inputs_hash)
+        if partial is None:
+            missing.append(index)
+            continue
+        route_scores.update(partial['route_scores'])
+        route_feasibility.update(partial['route_feasibility'])
+    if missing:
+        raise FileNotFoundError('No result for these inputs in {} for shards {} (of {})'.format(
+            output_dir,', '.join(map(str,missing)),count))
+    scores={'submission_score':'x','route_scores':{},'route_feasibility':{}}
+    for kwarg in kwargs:
+        scores[kwarg]=kwargs[kwarg]
+    # Same route order, and so the same mean, as evaluate
+    for route,_ in score.read_json_items(actual_routes_json):
+        scores['route_scores'][route]=route_scores[route]
+        scores['route_feasibility'][route]=route_feasibility[route]
+    scores['submission_score']=np.mean(list(scores['route_scores'].values()))
+    return scores
+
+def evaluate_sharded(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json,
+        output_dir,count,workers=1,validate=True,**kwargs):
+    '''
+    Calculates score for a submission one shard of routes at a time, skipping
+    the shards completed by a previous run, then merges the shards.
+
+    Parameters
+    ----------
+    actual_routes_json : str
+        filepath of JSON of actual routes.
+    submission_json : str
+        filepath of JSON of participant-created routes.
+    cost_matrices_json : str
+        filepath of JSON of estimated times to travel between stops of routes.
+    invalid_scores_json : str
+        filepath of JSON of scores assigned to routes if they are invalid.
+    output_dir : str
+        Directory of the partial result files.
+    count : int
+        Number of shards.
+    workers : int, optional
+        Number of shards scored at the same time, each in its own process.
+        The default is 1.
+    validate : bool, optional
+        If False, the inputs other than the submission are not checked with
+        good_format. The default is True.
+    **kwargs :
+        Inputs placed in output.
+
+    Returns
+    -------
+    scores : dict
+        Same as evaluate.
+
+    '''
+    inputs=(actual_routes_json,submission_json,cost_matrices_json,invalid_scores_json)
+    inputs_hash=input_cache.source_hash(*inputs)
+    pending=[index for index in range(count)
+        if read_shard(shard_path(output_dir,index,count),inputs_hash) is None]
+    if workers>1 and len(pending)>1:
+        if 'fork' in mp.get_all_start_methods():
+            context=mp.get_context('fork')
+        else:
+            context=mp.get_context()
+        with ProcessPoolExecutor(max_workers=workers,mp_context=context) as pool:
+            futures=[pool.submit(score_shard,*inputs,output_dir,index,count,validate,inputs_hash)
+                for index in pending]
+            for future in futures:
+                future.result()
+    else:
+        for index in pending:
+            score_shard(*inputs,output_dir,index,count,validate,inputs_hash)
+    return merge_shards(*inputs,output_dir,count,inputs_hash,**kwargs)
@@ -0,0 +1,245 @@
+from os import path
+from collections.abc import Mapping
+from datetime import datetime
+import glob, os
+import numpy as np
+
+# Categories stored as integer codes, -1 when missing
+ROUTE_SCORES=('Low', 'Medium', 'High')
+STOP_TYPES=('Dropoff', 'Station')
+SCAN_STATUSES=('DELIVERED', 'DELIVERY_ATTEMPTED', 'REJECTED')
+
+def category_code(value, categories):
+    """
+    Returns the index of `value` in `categories`, or -1 if it is missing or unknown
+    """
+    try:
+        return categories.index(value)
+    except ValueError:
+        return -1
+
+def parse_timestamp(value):
+    """
+    Returns a `YYYY-MM-DD hh:mm:ss` timestamp as a `numpy.datetime64`, or NaT if there is none (`NaN` in the data)
+
+    Hours are not always zero padded, so the timestamp is parsed with `datetime.strptime`
+    """
+    if not isinstance(value, str):
+        return np.datetime64('NaT', 's')
+    return np.datetime64(datetime.strptime(value, '%Y-%m-%d %H:%M:%S'), 's')
+
+def parse_seconds(value):
+    """
+    Returns a `hh:mm:ss` time of day in seconds, or -1 if there is none
+    """
+    if not isinstance(value, str):
+        return -1
+    hours, minutes, seconds=value.split(':')
+    return int(hours)*3600+int(minutes)*60+int(seconds)
+
+def build_feature_store(directory, route_data, package_data=None):
+    """
+    Converts route data, and optionally package data, into a columnar feature store saved in `directory`
+
+    Takes in dictionaries in the format of `route_data.json` and `package_data.json` (or their `new_` counterparts)
+
+    Each column is a NumPy array saved to its own `<table>.<column>.npy` file, so that `FeatureStore` can memory-map it:
+    - `routes`: one row per route, with `stop_offsets` giving the rows of its stops in `stops`
+    - `stops`: one row per stop, with `zone` indexing `zones.zone_id` and `package_offsets` giving the rows of its
+      packages in `packages`
+    - `packages`: one row per package, with time windows as `datetime64[s]` (NaT when there is none)
+    - `zones`: the distinct zone ids, sorted
+
+    Returns a `FeatureStore` of `directory`
+
+    EG:
+
+    Input:
+    ```
+    build_feature_store('data/model_build_outputs/features', route_data, package_data)
+    ```
+
+    Output:
+    ```
+    data/model_build_outputs/features/routes.route_id.npy
+    data/model_build_outputs/features/routes.stop_offsets.npy
+    ...
+    data/model_build_outputs/features/stops.lat.npy
+    ...
+    ```
+    """
+    routes={key:[] for key in ('route_id', 'station_code', 'date', 'departure_time', 'executor_capacity_cm3', 'route_score')}
+    stops={key:[] for key in ('stop_id', 'lat', 'lng', 'type', 'zone_id')}
+    packages={key:[] for key in ('package_id', 'scan_status', 'start_time', 'end_time', 'planned_service_time_seconds', 'depth_cm', 'height_cm', 'width_cm')}
+    stop_offsets=[0]
+    package_offsets=[0]
+    for route_id, route in route_data.items():
+        routes['route_id'].append(route_id)
+        routes['station_code'].append(route.get('station_code') or '')
+        routes['date'].append(route.get('date_YYYY_MM_DD') or 'NaT')
+        routes['departure_time'].append(parse_seconds(route.get('departure_time_utc')))
+        routes['executor_capacity_cm3'].append(route.get('executor_capacity_cm3', np.nan))
+        routes['route_score'].append(category_code(route.get('route_score'), ROUTE_SCORES))
+        route_packages=package_data.get(route_id, {}) if package_data is not None else {}
+        for stop_id, stop in route['stops'].items():
+            stops['stop_id'].append(stop_id)
+            stops['lat'].append(stop.get('lat', np.nan))
+            stops['lng'].append(stop.get('lng', np.nan))
+            stops['type'].append(category_code(stop.get('type'), STOP_TYPES))
+            stops['zone_id'].append(stop.get('zone_id') if isinstance(stop.get('zone_id'), str) else '')
+            for package_id, package in route_packages.get(stop_id, {}).items():
+                time_window=package.get('time_window', {})
+                dimensions=package.get('dimensions', {})
+                packages['package_id'].append(package_id)
+                packages['scan_status'].append(category_code(package.get('scan_status'), SCAN_STATUSES))
+                packages['start_time'].append(parse_timestamp(time_window.get('start_time_utc')))
+                packages['end_time'].append(parse_timestamp(time_window.get('end_time_utc')))
+                packages['planned_service_time_seconds'].append(package.get('planned_service_time_seconds', np.nan))
+                for key in ('depth_cm', 'height_cm', 'width_cm'):
+                    packages[key].append(dimensions.get(key, np.nan))
+            package_offsets.append(len(packages['package_id']))
+        stop_offsets.append(len(stops['stop_id']))
+
+    zone_ids, zones=np.unique(np.array(stops.pop('zone_id'), dtype='S'), return_inverse=True)
+    # The empty zone id, sorted first, stands for a stop without a zone
+    if len(zone_ids) and zone_ids[0]==b'':
+        zone_ids, zones=zone_ids[1:], zones-1
+    tables={
+        'routes':{
+            'route_id':np.array(routes['route_id'], dtype='S'),
+            'station_code':np.array(routes['station_code'], dtype='S'),
+            'date':np.array(routes['date'], dtype='datetime64[D]'),
+            'departure_time':np.array(routes['departure_time'], dtype=np.int32),
+            'executor_capacity_cm3':np.array(routes['executor_capacity_cm3'], dtype=float),
+            'route_score':np.array(routes['route_score'], dtype=np.int8),
+            'stop_offsets':np.array(stop_offsets, dtype=np.int64)
+        },
+        'stops':{
+            'stop_id':np.array(stops['stop_id'], dtype='S'),
+            'lat':np.array(stops['lat'], dtype=float),
+            'lng':np.array(stops['lng'], dtype=float),
+            'type':np.array(stops['type'], dtype=np.int8),
+            'zone':zones.astype(np.int32).reshape(-1),
+            'package_offsets':np.array(package_offsets, dtype=np.int64)
+        },
+        'packages':{
+            'package_id':np.array(packages['package_id'], dtype='S'),
+            'scan_status':np.array(packages['scan_status'], dtype=np.int8),
+            'start_time':np.array(packages['start_time'], dtype='datetime64[s]'),
+            'end_time':np.array(packages['end_time'], dtype='datetime64[s]'),
+            'planned_service_time_seconds':np.array(packages['planned_service_time_seconds'], dtype=float),
+            'depth_cm':np.array(packages['depth_cm'], dtype=float),
+            'height_cm':np.array(packages['height_cm'], dtype=float),
+            'width_cm':np.array(packages['width_cm'], dtype=float)
+        },
+        'zones':{
+            'zone_id':zone_ids
+        }
+    }
+    os.makedirs(directory, exist_ok=True)
+    for table, columns in tables.items():
+        for column, values in columns.items():
+            np.save(path.join(directory, '{}.{}.npy'.format(table, column)), values)
+    return FeatureStore(directory)
+
+class FeatureStore(Mapping):
+    """
+    Memory-mapped feature store saved by `build_feature_store`
+
+    The columns of each table are available as NumPy arrays, such as `store.stops['lat']`. Loading a store only maps its
+    files, so it takes milliseconds, and the pages of the arrays are shared by every process that reads them
+
+    The store is also a read-only dictionary of the routes in the format of `route_data.json`, each decoded when
+    accessed, so it can replace the dictionary loaded from the JSON file
+
+    EG:
+
+    Input:
+    ```
+    store=FeatureStore('data/model_build_outputs/features')
+    route=store.route_index('RouteID_1a279ac2-41aa-4a5e-85de-061f3475896c')
+    print(store.stops['lat'][store.stop_rows(route)])
+    print(store['RouteID_1a279ac2-41aa-4a5e-85de-061f3475896c']['stops']['AA'])
+    ```
+
+    Output:
+    ```
+    [30.396307 30.399494 30.393832]
+    {'lat': 30.396307, 'lng': -97.691442, 'type': 'Dropoff', 'zone_id': 'E-20.2H'}
+    ```
+    """
+    def __init__(self, directory, mmap_mode='r'):
+        self.directory=directory
+        self.tables={}
+        for file_path in sorted(glob.glob(path.join(directory, '*.*.npy'))):
+            table, column=path.basename(file_path)[:-len('.npy')].split('.', 1)
+            self.tables.setdefault(table, {})[column]=np.load(file_path, mmap_mode=mmap_mode)
+        self.routes=self.tables['routes']
+        self.stops=self.tables['stops']
+        self.packages=self.tables['packages']
+        self.zones=self.tables['zones']
+        self.index={route_id.decode():row for row, route_id in enumerate(self.routes['route_id'])}
+
+    def route_index(self, route_id):
+        """
+        Returns the row of a route in the `routes` table
+        """
+        return self.index[route_id]
+
+    def stop_rows(self, route):
+        """
+        Returns the rows of the stops of the route in row `route` of the `routes` table, as a slice of the `stops` table
+        """
+        offsets=self.routes['stop_offsets']
+        return slice(int(offsets[route]), int(offsets[route+1]))
+
+    def package_rows(self, stop):
+        """
+        Returns the rows of the packages of the stop in row `stop` of the `stops` table, as a slice of the `packages`
+        table
+        """
+        offsets=self.stops['package_offsets']
+        return slice(int(offsets[stop]), int(offsets[stop+1]))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, route_id):
+        """
+        Returns a route in the format of `route_data.json`
+        """
+        route=self.index[route_id]
+        date=self.routes['date'][route]
+        departure_time=int(self.routes['departure_time'][route])
+        route_score=int(self.routes['route_score'][route])
+        capacity=float(self.routes['executor_capacity_cm3'][route])
+        output={
+            'station_code':self.routes['station_code'][route].decode(),
+            'date_YYYY_MM_DD':None if np.isnat(date) else str(date),
+            'departure_time_utc':None if departure_time<0 else '{:02d}:{:02d}:{:02d}'.format(
+                departure_time//3600, departure_time//60%60, departure_time%60),
+            'executor_capacity_cm3':None if np.isnan(capacity) else int(capacity)
+        }
+        if route_score>=0:
+            output['route_score']=ROUTE_SCORES[route_score]
+        rows=self.stop_rows(route)
+        zone_ids=self.zones['zone_id']
+        output['stops']={
+            stop_id.decode():{
+                'lat':float(lat),
+                'lng':float(lng),
+                'type':STOP_TYPES[stop_type] if stop_type>=0 else None,
+                'zone_id':zone_ids[zone].decode() if zone>=0 else None
+            }
+            for stop_id, lat, lng, stop_type, zone in zip(
+                self.stops['stop_id'][rows].tolist(),
+                self.stops['lat'][rows].tolist(),
+                self.stops['lng'][rows].tolist(),
+                self.stops['type'][rows].tolist(),
+                self.stops['zone'][rows].tolist()
+            )
+        }
+        return output
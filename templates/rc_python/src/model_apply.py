@@ -1,100 +1,381 @@
 from os import path
-import sys, json, time
+import json, math, os, tempfile, time
+import multiprocessing as mp
+import numpy as np
+import feature_store, zone_transitions
+from lazy_json import LazyJSON, TravelTimes
 
 # Get Directory
 BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
 
+# Time limit of model apply in seconds, after which the app is stopped (4 hours in the production test)
+START_TIME = time.time()
+TIME_LIMIT = float(os.environ.get('MODEL_APPLY_TIME_LIMIT', 4*60*60))
+# Stop improving routes early enough to write the output before the time limit
+DEADLINE = START_TIME+0.9*TIME_LIMIT
+# Seconds between two writes of the best sequences found so far
+CHECKPOINT_INTERVAL = 60
+# Code of the `Station` stop type in the `type` column of the feature store
+STATION = feature_store.STOP_TYPES.index('Station')
+# Stops whose travel time is within this fraction of the closest one are close enough for the nearest neighbor tour to
+# choose between them by zone transition probability
+ZONE_TOLERANCE = 0.1
+
 # Read input data
 print('Reading Input Data')
 # Model Build output
 model_path=path.join(BASE_DIR, 'data/model_build_outputs/model.json')
 with open(model_path, newline='') as in_file:
     model_build_out = json.load(in_file)
+# The large inputs are indexed instead of loaded whole, and each route is read from its file when it is accessed
 # Prediction Routes (Model Apply input)
 prediction_routes_path = path.join(BASE_DIR, 'data/model_apply_inputs/new_route_data.json')
-with open(prediction_routes_path, newline='') as in_file:
-    prediction_routes = json.load(in_file)
+prediction_routes = LazyJSON(prediction_routes_path)
+# Travel times between the stops of each route (Model Apply input)
+travel_times_path = path.join(BASE_DIR, 'data/model_apply_inputs/new_travel_times.json')
+travel_times = LazyJSON(travel_times_path, record=TravelTimes)
+
+# Load the zone transition probabilities of the training routes, saved by model_build.py
+transitions=zone_transitions.ZoneTransitions(path.join(BASE_DIR, 'data/model_build_outputs', model_build_out['zone_transitions']))
+print('Loaded the transition probabilities of {} zones'.format(len(transitions)))
+# Convert the Prediction Routes to a feature store, whose arrays are shared by the processes proposing routes instead
+# of a dictionary that each process would end up copying. The solver reads the stops of each route from its columns.
+# Packages are not converted, since the solver does not use them
+prediction_features_dir=tempfile.TemporaryDirectory()
+prediction_routes=feature_store.build_feature_store(prediction_features_dir.name, prediction_routes)
+
+def station_first(features, route):
+    """
+    Returns the stop ids of the route in row `route` of a `FeatureStore`, read from its columns, with the station first,
+    the first stop of type `Station`, and the other stops in their input order
+    """
+    rows=features.stop_rows(route)
+    stop_ids=features.stops['stop_id'][rows].astype(str).tolist()
+    stations=np.flatnonzero(features.stops['type'][rows]==STATION)
+    if len(stations):
+        stop_ids.insert(0, stop_ids.pop(int(stations[0])))
+    return stop_ids
+
+def initial_sequence(stop_ids):
+    """
+    Returns a valid sequence of a route at no cost: its stop ids in the order of `station_first`
+    """
+    return {stop_id:order for order, stop_id in enumerate(stop_ids)}
+
+def zone_preferences(features, route, stop_ids, transitions):
+    """
+    Returns the matrix of the probabilities that historical routes of the station went from the zone of each stop to the
+    zone of each other stop, for the route in row `route` of a `FeatureStore`, with its stops in the order of `stop_ids`
+
+    Takes in the `ZoneTransitions` learned by model_build.py
+    """
+    rows=features.stop_rows(route)
+    zone_ids=features.zones['zone_id']
+    stop_zones={
+        stop_id:zone_ids[zone].decode() if zone>=0 else None
+        for stop_id, zone in zip(features.stops['stop_id'][rows].astype(str).tolist(), features.stops['zone'][rows].tolist())
+    }
+    station_code=features.routes['station_code'][route].decode()
+    return transitions.route_probabilities(station_code, [stop_zones[stop_id] for stop_id in stop_ids])
 
-def sort_by_key(stops, sort_by):
+def route_matrix(stop_ids, route_travel_times):
     """
-    Takes in the `prediction_routes[route_id]['stops']` dictionary
-    Returns a dictionary of the stops with their sorted order always placing the depot first
+    Builds the dense travel time matrix of a route
+
+    Takes in the stop ids of the route, with the station first, and the `TravelTimes` of the route
+    Returns the matrix of travel times between the stops in that order
+
+    Missing travel times are replaced by a time longer than any tour of known travel times, so the solver only uses them
+    when it has to. The matrix stays finite, so the cumulative sums of `best_two_opt_move` never mix infinities
 
     EG:
 
     Input:
     ```
-    stops={
-      "Depot": {
-        "lat": 42.139891,
-        "lng": -71.494346,
-        "type": "depot",
-        "zone_id": null
-      },
-      "StopID_001": {
-        "lat": 43.139891,
-        "lng": -71.494346,
-        "type": "delivery",
-        "zone_id": "A-2.2A"
-      },
-      "StopID_002": {
-        "lat": 42.139891,
-        "lng": -71.494346,
-        "type": "delivery",
-        "zone_id": "P-13.1B"
-      }
-    }
+    route_travel_times=TravelTimes({
+      "AA": {"AA": 0, "BB": 35.2},
+      "BB": {"AA": 40.1, "BB": 0}
+    })
+
+    print(route_matrix(['BB', 'AA'], route_travel_times))
+    ```
+
+    Output:
+    ```
+    array([[ 0. , 40.1],
+           [35.2,  0. ]])
+    ```
+    """
+    n=len(route_travel_times.stop_ids)
+    # An extra row and column of infinite travel times stand for stops without travel times
+    times=np.full((n+1, n+1), np.inf)
+    times[:n, :n]=np.frombuffer(route_travel_times.times, dtype=float).reshape(n, n)
+    rows=np.array([route_travel_times.index.get(stop_id, n) for stop_id in stop_ids], dtype=int)
+    times=times[np.ix_(rows, rows)]
+    known=np.isfinite(times)
+    missing=len(stop_ids)*(times[known].max() if known.any() else 0)+1
+    return np.where(known, times, missing)
+
+def nearest_neighbor(matrix, preferences=None, tolerance=ZONE_TOLERANCE):
+    """
+    Builds a tour that starts at stop 0 and always travels to the closest stop not visited yet
+
+    With a `preferences` matrix, such as that of `zone_preferences`, ties are broken by preference: of the stops within
+    `tolerance` of the closest travel time, the next stop is the most preferred one, then the closest one
+
+    Returns the tour as an array of stop indices, starting and ending with 0
+    """
+    n=len(matrix)
+    visited=np.zeros(n, dtype=bool)
+    visited[0]=True
+    tour=[0]
+    for _ in range(n-1):
+        times=np.where(visited, np.inf, matrix[tour[-1]])
+        closest=int(np.argmin(times))
+        if preferences is not None:
+            candidates=np.flatnonzero(times<=times[closest]*(1+tolerance))
+            closest=int(candidates[np.lexsort((times[candidates], -preferences[tour[-1], candidates]))[0]])
+        visited[closest]=True
+        tour.append(closest)
+    tour.append(0)
+    return np.array(tour)
+
+def best_two_opt_move(tour, matrix):
+    """
+    Finds the best 2-opt move of a tour: reversing the stops between two positions
+
+    Travel times may be asymmetric, so the time of the reversed segment is computed from cumulative sums of the
+    forward and backward travel times along the tour, for every pair of positions at once
+
+    Returns the change in total travel time and the first and last reversed positions
+    """
+    forward=np.concatenate(([0], np.cumsum(matrix[tour[:-1], tour[1:]])))
+    backward=np.concatenate(([0], np.cumsum(matrix[tour[1:], tour[:-1]])))
+    n=len(tour)-1
+    # Reverse tour[i:j+1], for 1 <= i < j <= n-1
+    i=np.arange(1, n)[:, None]
+    j=np.arange(1, n)[None, :]
+    delta=(
+        matrix[tour[i-1], tour[j]]+matrix[tour[i], tour[j+1]]+(backward[j]-backward[i])
+        -matrix[tour[i-1], tour[i]]-matrix[tour[j], tour[j+1]]-(forward[j]-forward[i])
+    )
+    delta=np.where(j>i, delta, np.inf)
+    best=np.unravel_index(np.argmin(delta), delta.shape)
+    return delta[best], best[0]+1, best[1]+1
+
+def best_or_opt_move(tour, matrix, max_length=3):
+    """
+    Finds the best or-opt move of a tour: moving a segment of up to `max_length` consecutive stops elsewhere,
+    keeping its direction
+
+    Returns the change in total travel time, the first position and length of the moved segment, and the position
+    after which it is inserted, in the tour without the segment
+    """
+    n=len(tour)-1
+    best=(np.inf, None, None, None)
+    for length in range(1, min(max_length, n-2)+1):
+        # Segment tour[s:s+length], for 1 <= s <= n-length
+        s=np.arange(1, n-length+1)[:, None]
+        first=tour[s]
+        last=tour[s+length-1]
+        removal=matrix[tour[s-1], first]+matrix[last, tour[s+length]]-matrix[tour[s-1], tour[s+length]]
+        # Insert between tour[p] and tour[p+1], outside of the segment and its current place
+        p=np.arange(0, n)[None, :]
+        insertion=matrix[tour[p], first]+matrix[last, tour[p+1]]-matrix[tour[p], tour[p+1]]
+        delta=np.where((p<s-1) | (p>=s+length), insertion-removal, np.inf)
+        index=np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[index]<best[0]:
+            best=(delta[index], int(s[index[0], 0]), length, int(p[0, index[1]]))
+    return best
+
+def improve(tour, matrix, max_moves=10000, tolerance=1e-9, deadline=None):
+    """
+    Applies the best improving 2-opt or or-opt move until neither improves the tour, or until `deadline` (a `time.time()`
+    value) has passed
+
+    Moves must shorten the tour by more than `tolerance` times its initial travel time, so rounding errors in the
+    deltas of long tours cannot make the search cycle
+
+    Returns the improved tour
+    """
+    tour=tour.copy()
+    tolerance*=1+matrix[tour[:-1], tour[1:]].sum()
+    for _ in range(max_moves):
+        if deadline is not None and time.time()>deadline:
+            break
+        delta, i, j=best_two_opt_move(tour, matrix)
+        if delta< -tolerance:
+            tour[i:j+1]=tour[i:j+1][::-1]
+            continue
+        delta, start, length, after=best_or_opt_move(tour, matrix)
+        if delta< -tolerance:
+            segment=tour[start:start+length]
+            rest=np.concatenate((tour[:start], tour[start+length:]))
+            # Positions after the segment move back by its length once it is removed
+            after=after if after<start else after-length
+            tour=np.concatenate((rest[:after+1], segment, rest[after+1:]))
+            continue
+        break
+    return tour
+
+def propose_route(stop_ids, route_travel_times, deadline=None, preferences=None):
+    """
+    Proposes the sequence of a route with a nearest neighbor tour improved by 2-opt and or-opt moves until `deadline`
+
+    Takes in the stop ids of the route, with the station first, and the `TravelTimes` of the route. The nearest neighbor
+    tour breaks ties with the `preferences` matrix, if given
+    Returns a dictionary of the stops with their order in the tour, always placing the station first
+
+    EG:
 
-    print (sort_by_key(stops, 'lat'))
+    Input:
+    ```
+    print(propose_route(['BB', 'AA', 'CC'], travel_times['RouteID_001']))
     ```
 
     Output:
     ```
     {
-        "Depot":1,
-        "StopID_001":3,
-        "StopID_002":2
+        "BB":0,
+        "CC":1,
+        "AA":2
     }
     ```
+    """
+    matrix=route_matrix(stop_ids, route_travel_times)
+    tour=nearest_neighbor(matrix, preferences)
+    if len(stop_ids)>3:
+        tour=improve(tour, matrix, deadline=deadline)
+    return {stop_ids[stop]:order for order, stop in enumerate(tour[:-1].tolist())}
+
+def cgroup_cpu_quota():
+    """
+    Returns the number of CPUs allowed by the container's cgroup CPU quota (`docker run --cpus`), or None without a quota
 
+    Reads the cgroup v2 `cpu.max` file, or the cgroup v1 `cpu.cfs_quota_us` and `cpu.cfs_period_us` files
     """
-    # Serialize keys as id into each dictionary value and make the dict a list
-    stops_list=[{**value, **{'id':key}} for key, value in stops.items()]
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as in_file:
+            quota, period=in_file.read().split()
+        return None if quota=='max' else int(quota)/int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as in_file:
+            quota=int(in_file.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as in_file:
+            period=int(in_file.read())
+        return None if quota<=0 else quota/period
+    except (OSError, ValueError):
+        return None
 
-    # Sort the stops list by the key specified when calling the sort_by_key func
-    ordered_stop_list=sorted(stops_list, key=lambda x: x[sort_by])
+def available_cpus():
+    """
+    Returns the number of CPUs this process can use
+
+    `os.cpu_count` counts every CPU of the host, even when the container is limited to a few of them
+    """
+    try:
+        cpus=len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus=os.cpu_count() or 1
+    quota=cgroup_cpu_quota()
+    if quota is not None:
+        cpus=min(cpus, max(1, math.ceil(quota)))
+    return cpus
 
-    # Keep only sorted list of ids
-    ordered_stop_list_ids=[i['id'] for i in ordered_stop_list]
+def stop_counts(features):
+    """
+    Returns a dictionary of the number of stops of each route of a `FeatureStore`, taken from the offsets of their stops
+    without decoding the routes
+    """
+    return dict(zip(features, np.diff(features.routes['stop_offsets']).tolist()))
 
-    # Serialize back to dictionary format with output order as the values
-    return {i:ordered_stop_list_ids.index(i) for i in ordered_stop_list_ids}
+def time_limits(counts, time_budget, workers=1):
+    """
+    Splits `time_budget` seconds of `workers` processes between routes, in proportion to the square of their number of
+    stops, which is the number of moves compared at each step of `improve`
 
-def propose_all_routes(prediction_routes, sort_by):
+    Takes in the dictionary of `stop_counts`
+    Returns a dictionary of the time limit of each route in seconds
     """
-    Applies `sort_by_key` to each route's set of stops and returns them in a dictionary under `output[route_id]['proposed']`
+    weights={key:count**2 for key, count in counts.items()}
+    total=sum(weights.values()) or 1
+    return {key:max(0, time_budget)*workers*weight/total for key, weight in weights.items()}
+
+def write_output(proposals, prediction_routes, output_path):
+    """
+    Writes the sequences of every route in `proposals` to `output_path`, in the order of `prediction_routes`
+
+    The file is written under a temporary name, then renamed, so `output_path` always holds a complete file, even if the
+    app is stopped while writing
+    """
+    output={key:{'proposed':proposals[key]} for key in prediction_routes}
+    tmp_path='{}.tmp'.format(output_path)
+    with open(tmp_path, 'w') as out_file:
+        json.dump(output, out_file)
+    os.replace(tmp_path, output_path)
+    return output
+
+# Inputs of the processes proposing routes, set by `init_worker`
+worker_inputs={}
+
+def init_worker(prediction_routes, travel_times, deadline=None, transitions=None):
+    """
+    Makes the inputs available to `propose_route_by_id`
+
+    Worker processes are forked, so they share the inputs of the main process instead of receiving a pickled copy
+    """
+    worker_inputs['prediction_routes']=prediction_routes
+    worker_inputs['travel_times']=travel_times
+    worker_inputs['deadline']=deadline
+    worker_inputs['transitions']=transitions
+
+def propose_route_by_id(task):
+    """
+    Applies `propose_route` to a route of the inputs set by `init_worker` and returns its id with its sequence
+
+    Takes in the route id and its time limit in seconds, or None for no time limit
+    """
+    route_id, time_limit=task
+    deadline=worker_inputs['deadline']
+    if time_limit is not None:
+        deadline=min(deadline, time.time()+time_limit) if deadline is not None else time.time()+time_limit
+    features=worker_inputs['prediction_routes']
+    route=features.route_index(route_id)
+    stop_ids=station_first(features, route)
+    transitions=worker_inputs['transitions']
+    preferences=zone_preferences(features, route, stop_ids, transitions) if transitions is not None else None
+    return route_id, propose_route(
+        stop_ids=stop_ids,
+        route_travel_times=worker_inputs['travel_times'][route_id],
+        deadline=deadline,
+        preferences=preferences
+    )
+
+def propose_all_routes(prediction_routes, travel_times, workers=1, deadline=None, output_path=None, checkpoint_interval=60, transitions=None):
+    """
+    Applies `propose_route` to each route's set of stops and returns them in a dictionary under `output[route_id]['proposed']`
+
+    Takes in the `FeatureStore` of the prediction routes and their `TravelTimes`, and optionally the `ZoneTransitions`
+    learned by model_build.py to break the ties of the nearest neighbor tours
+
+    With more than one worker, routes are proposed by a pool of processes, largest routes first so that no process is
+    left with a large route at the end. The output is in the order of `prediction_routes` either way
+
+    With a `deadline`, the time left until then is split between routes by `time_limits`, and no route is improved past it
+
+    With an `output_path`, a valid sequence of every route is written there first, then the best sequences found so far
+    every `checkpoint_interval` seconds and once all routes are proposed, so that the app still leaves a complete output
+    if it is stopped
 
     EG:
 
     Input:
     ```
-    prediction_routes = {
-      "RouteID_001": {
-        ...
-        "stops": {
-          "Depot": {
-            "lat": 42.139891,
-            "lng": -71.494346,
-            "type": "depot",
-            "zone_id": null
-          },
-          ...
-        }
-      },
-      ...
-    }
+    prediction_routes=feature_store.build_feature_store('features', LazyJSON('data/model_apply_inputs/new_route_data.json'))
 
-    print(propose_all_routes(prediction_routes, 'lat'))
+    print(propose_all_routes(prediction_routes, travel_times, workers=4))
     ```
 
     Output:
@@ -111,34 +392,55 @@ def propose_all_routes(prediction_routes, sort_by):
     }
     ```
     """
-    return {key:{'proposed':sort_by_key(stops=value['stops'], sort_by=sort_by)} for key, value in prediction_routes.items()}
-
-# Apply faux algorithms to pass time
-time.sleep(1)
-print('Solving Dark Matter Waveforms')
-time.sleep(1)
-print('Quantum Computer is Overheating')
-time.sleep(1)
-print('Trying Alternate Measurement Cycles')
-time.sleep(1)
-print('Found a Great Solution!')
-time.sleep(1)
-print('Checking Validity')
-time.sleep(1)
-print('The Answer is 42!')
-time.sleep(1)
+    proposals={key:initial_sequence(station_first(prediction_routes, prediction_routes.route_index(key))) for key in prediction_routes}
+    last_checkpoint=time.time()
+    if output_path is not None:
+        write_output(proposals, prediction_routes, output_path)
+    counts=stop_counts(prediction_routes)
+    if deadline is not None:
+        limits=time_limits(counts, deadline-time.time(), workers)
+    else:
+        limits=dict.fromkeys(prediction_routes)
+    route_ids=sorted(prediction_routes, key=counts.get, reverse=True)
+    tasks=[(key, limits[key]) for key in route_ids]
+    start=time.time()
+    def collect(results):
+        nonlocal last_checkpoint
+        for count, (route_id, proposed) in enumerate(results, 1):
+            proposals[route_id]=proposed
+            if count%100==0 or count==len(route_ids):
+                print('Proposed {}/{} routes in {:.1f} seconds'.format(count, len(route_ids), time.time()-start))
+            if output_path is not None and time.time()-last_checkpoint>=checkpoint_interval:
+                write_output(proposals, prediction_routes, output_path)
+                last_checkpoint=time.time()
+    if workers>1 and len(route_ids)>1 and 'fork' in mp.get_all_start_methods():
+        context=mp.get_context('fork')
+        with context.Pool(workers, initializer=init_worker, initargs=(prediction_routes, travel_times, deadline, transitions)) as pool:
+            collect(pool.imap_unordered(propose_route_by_id, tasks))
+    else:
+        init_worker(prediction_routes, travel_times, deadline, transitions)
+        collect(map(propose_route_by_id, tasks))
+    if output_path is not None:
+        return write_output(proposals, prediction_routes, output_path)
+    return {key:{'proposed':proposals[key]} for key in prediction_routes}
 
 
 print('\nApplying answer with real model...')
-sort_by=model_build_out.get("sort_by")
-print('Sorting data by the key: {}'.format(sort_by))
-output=propose_all_routes(prediction_routes=prediction_routes, sort_by=sort_by)
-print('Data sorted!')
-
-# Write output data
+print('Model build output: {}'.format(model_build_out.get('Model')))
+workers=available_cpus()
+print('Solving routes with nearest neighbor construction and 2-opt/or-opt improvement on {} CPUs'.format(workers))
+print('Improving routes for up to {:.0f} seconds'.format(max(0, DEADLINE-time.time())))
 output_path=path.join(BASE_DIR, 'data/model_apply_outputs/proposed_sequences.json')
-with open(output_path, 'w') as out_file:
-    json.dump(output, out_file)
-    print("Success: The '{}' file has been saved".format(output_path))
+output=propose_all_routes(
+    prediction_routes=prediction_routes,
+    travel_times=travel_times,
+    workers=workers,
+    deadline=DEADLINE,
+    output_path=output_path,
+    checkpoint_interval=CHECKPOINT_INTERVAL,
+    transitions=transitions
+)
+print('Routes solved!')
+print("Success: The '{}' file has been saved".format(output_path))
 
 print('Done!')
@@ -1,33 +1,45 @@
 from os import path
-import sys, json, time
+import json
+import feature_store, zone_transitions
+from lazy_json import LazyJSON
 
 # Get Directory
 BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
 
 # Read input data
 print('Reading Input Data')
+# The large inputs are indexed instead of loaded whole, and each route is read from its file when it is accessed
 training_routes_path=path.join(BASE_DIR, 'data/model_build_inputs/route_data.json')
-with open(training_routes_path, newline='') as in_file:
-    actual_routes = json.load(in_file)
+actual_routes = LazyJSON(training_routes_path)
+training_packages_path=path.join(BASE_DIR, 'data/model_build_inputs/package_data.json')
+training_packages = LazyJSON(training_packages_path)
+training_sequences_path=path.join(BASE_DIR, 'data/model_build_inputs/actual_sequences.json')
+training_sequences = LazyJSON(training_sequences_path)
 
 
-# Solve for something hard
-print('Initializing Quark Reducer')
-time.sleep(1)
-print('Placing Nano Tubes In Gravitational Wavepool')
-time.sleep(1)
-print('Measuring Particle Deviations')
-time.sleep(1)
-print('Programming Artificial Noggins')
-time.sleep(1)
-print('Beaming in Complex Materials')
-time.sleep(1)
-print('Solving Model')
-time.sleep(1)
+# Convert the training data to a feature store, which model_apply.py can load without parsing JSON
+print('Building Feature Store')
+features_path=path.join(BASE_DIR, 'data/model_build_outputs/features')
+features=feature_store.build_feature_store(features_path, actual_routes, training_packages)
+del actual_routes, training_packages
+print('Stored {} routes, {} stops and {} packages in {}'.format(
+    len(features.routes['route_id']), len(features.stops['stop_id']), len(features.packages['package_id']), features_path))
+
+# Learn how historical routes moved between zones, counting the routes with a better score more
+print('Learning Zone Transitions')
+transitions=zone_transitions.learn_zone_transitions(features, training_sequences)
+transitions_path=path.join(BASE_DIR, 'data/model_build_outputs/zone_transitions.npz')
+zone_transitions.save_zone_transitions(transitions_path, transitions)
+print('Counted transitions between {} pairs of {} zones and {} high-level zones'.format(
+    len(transitions['pair_count']), len(transitions['zone_id']), len(transitions['high_zone_id'])))
+
 print('Saving Solved Model State')
 output={
     'Model':'Hello from the model_build.py script!',
-    'sort_by':'lat'
+    'sort_by':'lat',
+    'features':'features',
+    'zone_transitions':'zone_transitions.npz',
+    'route_score_weights':zone_transitions.ROUTE_SCORE_WEIGHTS
 }
 
 # Write output data
@@ -0,0 +1,201 @@
+import numpy as np
+from feature_store import ROUTE_SCORES
+
+# Weight of the transitions of a historical route by its `route_score`. Routes without a score are not counted
+ROUTE_SCORE_WEIGHTS={'Low':1.0, 'Medium':2.0, 'High':3.0}
+
+def high_level_zone(zone_id):
+    """
+    Returns the high-level planning zone of a zone id, the text before the dash
+
+    EG:
+
+    Input:
+    ```
+    print(high_level_zone('E-20.2H'))
+    ```
+
+    Output:
+    ```
+    E
+    ```
+    """
+    return zone_id.split('-', 1)[0]
+
+def normalize_rows(counts, rows, row_count):
+    """
+    Divides each count by the total count of its row, leaving 0 for rows without any count
+    """
+    totals=np.bincount(rows, weights=counts, minlength=row_count)
+    return np.divide(counts, totals[rows], out=np.zeros(len(counts)), where=totals[rows]>0)
+
+def learn_zone_transitions(features, actual_sequences, route_score_weights=ROUTE_SCORE_WEIGHTS):
+    """
+    Counts the transitions between the zones of consecutive stops of historical routes, weighted by `route_score`
+
+    Takes in the `FeatureStore` of the training routes and a dictionary in the format of `actual_sequences.json`
+
+    Zone ids are only meaningful within a station, so each zone is a (station, zone id) pair, encoded as an integer.
+    Stops without a zone, such as the station, are skipped. Transitions are counted with a single `np.bincount` over all
+    routes:
+    - between zones, sparsely, as `pair_from`, `pair_to`, `pair_count` and `pair_probability` arrays sorted by zone
+      pair, where the probability is that of going to `pair_to` when leaving `pair_from`
+    - between high-level zones, densely, as `high_count` and `high_probability` matrices
+
+    Returns a dictionary of NumPy arrays, which `save_zone_transitions` saves
+
+    EG:
+
+    Input:
+    ```
+    transitions=learn_zone_transitions(features, actual_sequences)
+    print(transitions['zone_id'][:2], transitions['pair_from'][:2], transitions['pair_to'][:2], transitions['pair_probability'][:2])
+    ```
+
+    Output:
+    ```
+    [b'A-1.1A' b'A-1.1B'] [0 0] [0 1] [0.12 0.3]
+    ```
+    """
+    routes=features.routes
+    stops=features.stops
+    route_count=len(routes['route_id'])
+    stop_route=np.repeat(np.arange(route_count), np.diff(routes['stop_offsets']))
+    # Position of each stop in the actual sequence of its route, -1 if it has none
+    position=np.full(len(stops['stop_id']), -1, dtype=np.int64)
+    for route, route_id in enumerate(features):
+        actual=actual_sequences.get(route_id)
+        if actual is None:
+            continue
+        rows=features.stop_rows(route)
+        actual=actual['actual']
+        position[rows]=[actual.get(stop_id, -1) for stop_id in stops['stop_id'][rows].astype(str).tolist()]
+    score_weights=np.array([route_score_weights.get(route_score, 0.0) for route_score in ROUTE_SCORES]+[0.0])
+    # Scores are -1 when missing, the last weight
+    route_weight=score_weights[routes['route_score']]
+
+    stations, route_station=np.unique(routes['station_code'], return_inverse=True)
+    route_station=route_station.reshape(-1)
+    zone_count=len(features.zones['zone_id'])
+    zoned=np.flatnonzero((stops['zone']>=0) & (position>=0))
+    zone_keys, zones=np.unique(route_station[stop_route[zoned]].astype(np.int64)*zone_count+stops['zone'][zoned], return_inverse=True)
+    zones=zones.reshape(-1)
+    # Visit order of the zoned stops, route by route
+    order=np.lexsort((position[zoned], stop_route[zoned]))
+    visit_route=stop_route[zoned][order]
+    visit_zone=zones[order]
+    consecutive=visit_route[1:]==visit_route[:-1]
+    pair_from=visit_zone[:-1][consecutive]
+    pair_to=visit_zone[1:][consecutive]
+    weights=route_weight[visit_route[1:][consecutive]]
+
+    n=len(zone_keys)
+    pairs, pair_index=np.unique(pair_from.astype(np.int64)*n+pair_to, return_inverse=True)
+    pair_count=np.bincount(pair_index.reshape(-1), weights=weights, minlength=len(pairs)).astype(float)
+    counted=pair_count>0
+    pairs, pair_count=pairs[counted], pair_count[counted]
+
+    zone_station=(zone_keys//zone_count).astype(np.int32)
+    zone_ids=features.zones['zone_id'][zone_keys%zone_count]
+    # Bytes and float dtypes are explicit, since the arrays are empty when no stop has a zone
+    high_keys, zone_high=np.unique(
+        np.char.add(np.char.add(stations[zone_station], b' '), np.array([high_level_zone(zone_id).encode() for zone_id in zone_ids.astype(str)], dtype='S')),
+        return_inverse=True
+    )
+    zone_high=zone_high.reshape(-1).astype(np.int32)
+    h=len(high_keys)
+    high_count=np.bincount(zone_high[pair_from]*h+zone_high[pair_to], weights=weights, minlength=h*h).astype(float).reshape(h, h)
+    high_totals=high_count.sum(axis=1, keepdims=True)
+    return {
+        'stations':stations,
+        'zone_station':zone_station,
+        'zone_id':zone_ids,
+        'pair_from':(pairs//n).astype(np.int32),
+        'pair_to':(pairs%n).astype(np.int32),
+        'pair_count':pair_count,
+        'pair_probability':normalize_rows(pair_count, pairs//n, n),
+        'zone_high':zone_high,
+        'high_station':zone_station[np.unique(zone_high, return_index=True)[1]],
+        'high_zone_id':np.array([key.split(b' ', 1)[1] for key in high_keys], dtype='S'),
+        'high_count':high_count,
+        'high_probability':np.divide(high_count, high_totals, out=np.zeros_like(high_count), where=high_totals>0)
+    }
+
+def save_zone_transitions(file_path, transitions):
+    """
+    Saves the arrays of `learn_zone_transitions` to a `.npz` file
+    """
+    np.savez(file_path, **transitions)
+
+class ZoneTransitions:
+    """
+    Zone transition probabilities saved by `save_zone_transitions`, looked up in constant time
+
+    EG:
+
+    Input:
+    ```
+    transitions=ZoneTransitions('data/model_build_outputs/zone_transitions.npz')
+    print(transitions.probability('DLA7', 'G-25.2E', 'G-25.2F'), transitions.high_level_probability('DLA7', 'G-25.2E', 'H-1.1A'))
+    ```
+
+    Output:
+    ```
+    0.45 0.02
+    ```
+    """
+    def __init__(self, file_path):
+        with np.load(file_path) as arrays:
+            self.arrays={key:arrays[key] for key in arrays.files}
+        stations=self.arrays['stations'].astype(str)
+        self.zones={
+            (stations[station], zone_id):zone
+            for zone, (station, zone_id) in enumerate(zip(self.arrays['zone_station'].tolist(), self.arrays['zone_id'].astype(str).tolist()))
+        }
+        self.pairs={
+            (pair_from, pair_to):probability
+            for pair_from, pair_to, probability in zip(
+                self.arrays['pair_from'].tolist(), self.arrays['pair_to'].tolist(), self.arrays['pair_probability'].tolist())
+        }
+
+    def __len__(self):
+        return len(self.zones)
+
+    def probability(self, station_code, from_zone, to_zone):
+        """
+        Returns the probability that a historical route of the station went to `to_zone` when leaving `from_zone`, or
+        None if either zone was never visited
+        """
+        pair_from=self.zones.get((station_code, from_zone))
+        pair_to=self.zones.get((station_code, to_zone))
+        if pair_from is None or pair_to is None:
+            return None
+        return self.pairs.get((pair_from, pair_to), 0.0)
+
+    def high_level_probability(self, station_code, from_zone, to_zone):
+        """
+        Returns the same probability as `probability`, between the high-level zones of `from_zone` and `to_zone`
+        """
+        pair_from=self.zones.get((station_code, from_zone))
+        pair_to=self.zones.get((station_code, to_zone))
+        if pair_from is None or pair_to is None:
+            return None
+        zone_high=self.arrays['zone_high']
+        return float(self.arrays['high_probability'][zone_high[pair_from], zone_high[pair_to]])
+
+    def route_probabilities(self, station_code, zone_ids):
+        """
+        Returns the matrix of the `probability` of going from the zone of each stop of a route to the zone of each other
+        stop, 0 when either stop has no zone or its zone was never visited
+
+        Takes in the zone id of each stop, None for stops without a zone. Each pair of distinct zones is looked up once
+        """
+        distinct=sorted({zone_id for zone_id in zone_ids if zone_id is not None})
+        index={zone_id:k for k, zone_id in enumerate(distinct)}
+        # An extra row and column of zeros stand for stops without a zone
+        probabilities=np.zeros((len(distinct)+1, len(distinct)+1))
+        for from_zone in distinct:
+            for to_zone in distinct:
+                probabilities[index[from_zone], index[to_zone]]=self.probability(station_code, from_zone, to_zone) or 0.0
+        rows=np.array([index.get(zone_id, len(distinct)) for zone_id in zone_ids], dtype=int)
+        return probabilities[np.ix_(rows, rows)]
@@ -0,0 +1,196 @@
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+import json, re
+
+WHITESPACE=re.compile(r'[ \t\n\r]*')
+# Characters that can follow a complete JSON value
+DELIMITERS=' \t\n\r,:]}'
+
+def index_json_entries(file_path, chunk_size=1<<24):
+    """
+    Returns the byte offsets of the value of each top-level key of a JSON object file, such as `travel_times.json`
+
+    The file is read in one streaming pass. Each value is parsed to find where it ends, then discarded, so memory is
+    bounded by the largest value instead of the whole file
+
+    EG:
+
+    Input:
+    ```
+    print(index_json_entries('data/model_apply_inputs/new_travel_times.json'))
+    ```
+
+    Output:
+    ```
+    {
+      "RouteID_1a4903de-1a85-4bca-921a-f746c68fbf7a": (56, 1291),
+      "RouteID_1a4e2edf-3fde-409f-8bf6-f01ff98d5afa": (1341, 1602)
+    }
+    ```
+    """
+    decoder=json.JSONDecoder()
+    offsets={}
+    with open(file_path, 'rb') as in_file:
+        # Bytes are read as Latin-1, so an offset in the buffer is a number of bytes. Multibyte UTF-8 characters only
+        # occur inside strings, so they do not change where values end
+        buffer=''
+        # Offset in the file of the start of the buffer
+        base=0
+        eof=False
+
+        def fill(pos):
+            # Drop the text before pos and read at least as much as is left in the buffer
+            nonlocal buffer, base, eof
+            data=in_file.read(max(chunk_size, len(buffer)-pos)).decode('latin-1')
+            eof=not data
+            base+=pos
+            buffer=buffer[pos:]+data
+            return 0
+
+        def skip(pos):
+            while True:
+                pos=WHITESPACE.match(buffer, pos).end()
+                if pos<len(buffer) or eof:
+                    return pos
+                pos=fill(pos)
+
+        def parse(pos):
+            # Returns the start and end in the buffer of the value at pos, reading more of the file until it is complete
+            while True:
+                try:
+                    _, end=decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # A number cut by the end of the buffer, like "12." or "3.5" of "3.5e2", still decodes, so check it
+                    # is followed by a delimiter
+                    if eof or (end<len(buffer) and buffer[end] in DELIMITERS):
+                        return pos, end
+                pos=fill(pos)
+
+        def expect(pos, characters):
+            if buffer[pos:pos+1] not in characters:
+                raise ValueError("Expected one of '{}' at byte {} of {}".format(characters, base+pos, file_path))
+            return buffer[pos]
+
+        pos=skip(fill(0))
+        expect(pos, '{')
+        pos=skip(pos+1)
+        if buffer[pos:pos+1]=='}':
+            return offsets
+        while True:
+            pos, end=parse(pos)
+            key=json.loads(buffer[pos:end].encode('latin-1'))
+            pos=skip(end)
+            expect(pos, ':')
+            pos, end=parse(skip(pos+1))
+            offsets[key]=(base+pos, base+end)
+            pos=skip(end)
+            if expect(pos, ',}')=='}':
+                return offsets
+            pos=skip(pos+1)
+
+class LazyJSON(Mapping):
+    """
+    Read-only dictionary of the top-level entries of a large JSON object file, each decoded from the file when accessed
+
+    The byte offsets of the entries are found by `index_json_entries` when the dictionary is created. The `max_cached`
+    most recently used entries are kept, so iterating over the routes of a file holds one route at a time, instead of the
+    whole file. Entries are decoded with `record`, if given, such as `TravelTimes`
+
+    Each access opens the file, so the dictionary can be shared with forked worker processes
+
+    EG:
+
+    Input:
+    ```
+    travel_times=LazyJSON('data/model_apply_inputs/new_travel_times.json', record=TravelTimes)
+    print(len(travel_times))
+    print(travel_times['RouteID_1a4903de-1a85-4bca-921a-f746c68fbf7a'].get('AD', 'AR'))
+    ```
+
+    Output:
+    ```
+    2
+    225.0
+    ```
+    """
+    def __init__(self, file_path, record=None, max_cached=16):
+        self.file_path=file_path
+        self.record=record
+        self.max_cached=max_cached
+        self.offsets=index_json_entries(file_path)
+        self.cache=OrderedDict()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __getitem__(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        start, end=self.offsets[key]
+        with open(self.file_path, 'rb') as in_file:
+            in_file.seek(start)
+            value=json.loads(in_file.read(end-start))
+        if self.record is not None:
+            value=self.record(value)
+        self.cache[key]=value
+        if len(self.cache)>self.max_cached:
+            self.cache.popitem(last=False)
+        return value
+
+class TravelTimes:
+    """
+    Travel times between the stops of a route, in a flat array of `len(stop_ids)**2` floats in row order instead of a
+    dictionary of dictionaries. Missing travel times are infinite
+
+    Takes in the `travel_times[route_id]` dictionary
+
+    EG:
+
+    Input:
+    ```
+    route_travel_times=TravelTimes({
+      "AD": {"AD": 0, "AR": 225},
+      "AR": {"AD": 251.9, "AR": 0}
+    })
+    print(route_travel_times.stop_ids, route_travel_times.times, route_travel_times.get('AR', 'AD'))
+    ```
+
+    Output:
+    ```
+    ('AD', 'AR') array('d', [0.0, 225.0, 251.9, 0.0]) 251.9
+    ```
+    """
+    __slots__=('stop_ids', 'index', 'times')
+
+    def __init__(self, travel_times):
+        self.stop_ids=tuple(travel_times)
+        self.index={stop_id:row for row, stop_id in enumerate(self.stop_ids)}
+        self.times=array('d')
+        for origin in self.stop_ids:
+            row=travel_times[origin]
+            # Rows usually list every stop in the same order as the route
+            if tuple(row)==self.stop_ids:
+                self.times.extend(row.values())
+            else:
+                self.times.extend(row.get(destination, float('inf')) for destination in self.stop_ids)
+
+    def get(self, origin, destination, default=None):
+        """
+        Returns the travel time from `origin` to `destination`, or `default` if either is not a stop of the route
+        """
+        row=self.index.get(origin)
+        column=self.index.get(destination)
+        if row is None or column is None:
+            return default
+        return self.times[row*len(self.stop_ids)+column]
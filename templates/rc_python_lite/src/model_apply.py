@@ -1,5 +1,7 @@
 from os import path
-import sys, json, time
+import sys, json, math, os, time
+import multiprocessing as mp
+from lazy_json import LazyJSON
 
 # Get Directory
 BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
@@ -10,10 +12,10 @@ print('Reading Input Data')
 model_path=path.join(BASE_DIR, 'data/model_build_outputs/model.json')
 with open(model_path, newline='') as in_file:
     model_build_out = json.load(in_file)
-# Prediction Routes (Model Apply input)
+# Prediction Routes (Model Apply input), indexed instead of loaded whole, with each route read from the file when it is
+# accessed
 prediction_routes_path = path.join(BASE_DIR, 'data/model_apply_inputs/new_route_data.json')
-with open(prediction_routes_path, newline='') as in_file:
-    prediction_routes = json.load(in_file)
+prediction_routes = LazyJSON(prediction_routes_path)
 
 def sort_by_key(stops, sort_by):
     """
@@ -68,12 +70,70 @@ def sort_by_key(stops, sort_by):
     ordered_stop_list_ids=[i['id'] for i in ordered_stop_list]
 
     # Serialize back to dictionary format with output order as the values
-    return {i:ordered_stop_list_ids.index(i) for i in ordered_stop_list_ids}
+    return {stop_id:order for order, stop_id in enumerate(ordered_stop_list_ids)}
 
-def propose_all_routes(prediction_routes, sort_by):
+def cgroup_cpu_quota():
+    """
+    Returns the number of CPUs allowed by the container's cgroup CPU quota (`docker run --cpus`), or None without a quota
+
+    Reads the cgroup v2 `cpu.max` file, or the cgroup v1 `cpu.cfs_quota_us` and `cpu.cfs_period_us` files
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as in_file:
+            quota, period=in_file.read().split()
+        return None if quota=='max' else int(quota)/int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as in_file:
+            quota=int(in_file.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as in_file:
+            period=int(in_file.read())
+        return None if quota<=0 else quota/period
+    except (OSError, ValueError):
+        return None
+
+def available_cpus():
+    """
+    Returns the number of CPUs this process can use
+
+    `os.cpu_count` counts every CPU of the host, even when the container is limited to a few of them
+    """
+    try:
+        cpus=len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus=os.cpu_count() or 1
+    quota=cgroup_cpu_quota()
+    if quota is not None:
+        cpus=min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+# Inputs of the processes proposing routes, set by `init_worker`
+worker_inputs={}
+
+def init_worker(prediction_routes, sort_by):
+    """
+    Makes the inputs available to `propose_route_by_id`
+
+    Worker processes are forked, so they share the inputs of the main process instead of receiving a pickled copy
+    """
+    worker_inputs['prediction_routes']=prediction_routes
+    worker_inputs['sort_by']=sort_by
+
+def propose_route_by_id(route_id):
+    """
+    Applies `sort_by_key` to a route of the inputs set by `init_worker` and returns its id with its sequence
+    """
+    stops=worker_inputs['prediction_routes'][route_id]['stops']
+    return route_id, sort_by_key(stops=stops, sort_by=worker_inputs['sort_by'])
+
+def propose_all_routes(prediction_routes, sort_by, workers=1):
     """
     Applies `sort_by_key` to each route's set of stops and returns them in a dictionary under `output[route_id]['proposed']`
 
+    With more than one worker, routes are proposed by a pool of processes, largest routes first so that no process is
+    left with a large route at the end. The output is in the order of `prediction_routes` either way
+
     EG:
 
     Input:
@@ -94,7 +154,7 @@ def propose_all_routes(prediction_routes, sort_by):
       ...
     }
 
-    print(propose_all_routes(prediction_routes, 'lat'))
+    print(propose_all_routes(prediction_routes, 'lat', workers=4))
     ```
 
     Output:
@@ -111,7 +171,15 @@ def propose_all_routes(prediction_routes, sort_by):
     }
     ```
     """
-    return {key:{'proposed':sort_by_key(stops=value['stops'], sort_by=sort_by)} for key, value in prediction_routes.items()}
+    route_ids=sorted(prediction_routes, key=lambda key: len(prediction_routes[key]['stops']), reverse=True)
+    if workers>1 and len(route_ids)>1 and 'fork' in mp.get_all_start_methods():
+        context=mp.get_context('fork')
+        with context.Pool(workers, initializer=init_worker, initargs=(prediction_routes, sort_by)) as pool:
+            proposals=dict(pool.imap_unordered(propose_route_by_id, route_ids))
+    else:
+        init_worker(prediction_routes, sort_by)
+        proposals=dict(map(propose_route_by_id, route_ids))
+    return {key:{'proposed':proposals[key]} for key in prediction_routes}
 
 # Apply faux algorithms to pass time
 time.sleep(1)
@@ -131,8 +199,9 @@ time.sleep(1)
 
 print('\nApplying answer with real model...')
 sort_by=model_build_out.get("sort_by")
-print('Sorting data by the key: {}'.format(sort_by))
-output=propose_all_routes(prediction_routes=prediction_routes, sort_by=sort_by)
+workers=available_cpus()
+print('Sorting data by the key: {} on {} CPUs'.format(sort_by, workers))
+output=propose_all_routes(prediction_routes=prediction_routes, sort_by=sort_by, workers=workers)
 print('Data sorted!')
 
 # Write output data
@@ -1,14 +1,15 @@
 from os import path
 import sys, json, time
+from lazy_json import LazyJSON
 
 # Get Directory
 BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
 
 # Read input data
 print('Reading Input Data')
+# Training routes, indexed instead of loaded whole, with each route read from the file when it is accessed
 training_routes_path=path.join(BASE_DIR, 'data/model_build_inputs/route_data.json')
-with open(training_routes_path, newline='') as in_file:
-    actual_routes = json.load(in_file)
+actual_routes = LazyJSON(training_routes_path)
 
 
 # Solve for something hard